@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import nibabel as nib
+import recon as re
+
+
+class MRI(object):
+    params = [['.nii', '.nii.gz'], [100, 400]]
+    param_names = ['extension', 'n_tps']
+    timeout = 300
+
+    def setup(self, extension, n_tps):
+        rng = np.random.RandomState(42)
+        shape = (64, 64, 36)
+        self.tmpdir = tempfile.mkdtemp()
+        self.mask = os.path.join(self.tmpdir, 'mask.nii')
+        self.func = os.path.join(self.tmpdir, 'func' + extension)
+        self.out = os.path.join(self.tmpdir, 'out' + extension)
+
+        m = np.zeros(shape, dtype=np.uint8)
+        m[20:40, 10:30, 5:15] = 1
+        nib.save(nib.Nifti1Image(m, np.eye(4)), self.mask)
+        data = rng.normal(size=shape + (n_tps, )).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), self.func)
+        self.ts = data[m != 0]
+
+    def teardown(self, extension, n_tps):
+        shutil.rmtree(self.tmpdir)
+
+    def time_load_mri(self, extension, n_tps):
+        re.load_mri(self.func, self.mask)
+
+    def peakmem_load_mri(self, extension, n_tps):
+        re.load_mri(self.func, self.mask)
+
+    def time_iter_mri(self, extension, n_tps):
+        for ts in re.iter_mri(self.func, self.mask):
+            pass
+
+    def time_save_mri(self, extension, n_tps):
+        re.save_mri(self.ts, self.mask, self.out)
+
+    def peakmem_save_mri(self, extension, n_tps):
+        re.save_mri(self.ts, self.mask, self.out)
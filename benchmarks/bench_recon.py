@@ -0,0 +1,127 @@
+import subprocess
+import sys
+import numpy as np
+import recon as re
+
+# skip parameter combinations whose design matrix exceeds this many entries,
+# the multivariate method decomposes a (min(n_voxel, n_pixel))**2 matrix
+MAX_DESIGN_SIZE = 2e8
+MAX_GRAM_SIZE = 1e4
+
+
+def _n_pixel(resolution, extent=(-8, 8, -8, 8)):
+    xdim = round((extent[1] - extent[0]) / resolution)
+    ydim = round((extent[3] - extent[2]) / resolution)
+    return int(xdim * ydim)
+
+
+class GaussianReceptiveField(object):
+    params = [[1., 0.5, 0.1, 0.05]]
+    param_names = ['resolution']
+
+    def time_gaussian_receptive_field(self, resolution):
+        re.gaussian_receptive_field(1., 3., 1., resolution=resolution)
+
+    def time_gaussian_receptive_field_faster(self, resolution):
+        re.gaussian_receptive_field_faster(1., 3., 1., resolution=resolution)
+
+    def setup(self, resolution):
+        # compile outside of the timed section
+        re.gaussian_receptive_field_faster(1., 3., 1., resolution=resolution)
+
+
+class GaussianReceptiveFields(object):
+    params = [[100, 1000, 10000], [1., 0.5, 0.1]]
+    param_names = ['n_voxel', 'resolution']
+
+    def setup(self, n_voxel, resolution):
+        if n_voxel * _n_pixel(resolution) > MAX_DESIGN_SIZE:
+            raise NotImplementedError('too large')
+        self.prf = re.example_prf_data(n_voxel=n_voxel)[:3]
+
+    def time_gaussian_receptive_fields(self, n_voxel, resolution):
+        re.gaussian_receptive_fields(*self.prf, resolution=resolution)
+
+    def peakmem_gaussian_receptive_fields(self, n_voxel, resolution):
+        re.gaussian_receptive_fields(*self.prf, resolution=resolution)
+
+
+class StimulusReconstruction(object):
+    params = [['summation', 'multivariate'],
+              [100, 1000, 10000, 50000],
+              [1., 0.5, 0.1, 0.05]]
+    param_names = ['method', 'n_voxel', 'resolution']
+    timeout = 300
+
+    def setup(self, method, n_voxel, resolution):
+        if method == 'multivariate' and \
+                min(n_voxel, _n_pixel(resolution)) > MAX_GRAM_SIZE:
+            raise NotImplementedError('too large')
+        self.x0, self.y0, self.s0, _, self.betas = re.example_prf_data(
+            n_voxel=n_voxel)
+
+    def time_stimulus_reconstruction(self, method, n_voxel, resolution):
+        re.stimulus_reconstruction(self.x0, self.y0, self.s0, self.betas,
+                                   method=method, resolution=resolution)
+
+    def peakmem_stimulus_reconstruction(self, method, n_voxel, resolution):
+        re.stimulus_reconstruction(self.x0, self.y0, self.s0, self.betas,
+                                   method=method, resolution=resolution)
+
+
+class BatchedReconstruction(object):
+    # a whole run, more timepoints than pixels along x or y
+    params = [['summation', 'multivariate'], [1, 500]]
+    param_names = ['method', 'n_tps']
+    timeout = 300
+
+    def setup(self, method, n_tps):
+        self.x0, self.y0, self.s0, _, _ = re.example_prf_data(n_voxel=5000)
+        self.betas = np.random.RandomState(0).normal(size=(5000, n_tps))
+
+    def time_batched_reconstruction(self, method, n_tps):
+        re.stimulus_reconstruction(self.x0, self.y0, self.s0, self.betas,
+                                   method=method)
+
+    def peakmem_batched_reconstruction(self, method, n_tps):
+        re.stimulus_reconstruction(self.x0, self.y0, self.s0, self.betas,
+                                   method=method)
+
+
+class SummationEngine(object):
+    params = [['blas', 'numba', 'fft'],
+              [1000, 50000],
+              [0.5, 0.1, 0.05]]
+    param_names = ['engine', 'n_voxel', 'resolution']
+    timeout = 300
+
+    def setup(self, engine, n_voxel, resolution):
+        self.x0, self.y0, self.s0, _, self.betas = re.example_prf_data(
+            n_voxel=n_voxel)
+
+    def time_summation(self, engine, n_voxel, resolution):
+        re.stimulus_reconstruction(self.x0, self.y0, self.s0, self.betas,
+                                   resolution=resolution, engine=engine)
+
+
+class SelectPRF(object):
+    params = [[1000, 100000]]
+    param_names = ['n_voxel']
+
+    def setup(self, n_voxel):
+        self.prf = re.example_prf_data(n_voxel=n_voxel)[:4]
+
+    def time_select_prf(self, n_voxel):
+        re.select_prf(*self.prf, verbose=False)
+
+
+class Import(object):
+
+    def timeraw_import_recon(self):
+        return "import recon"
+
+    def track_heavy_modules_imported(self):
+        code = ("import sys, recon; print(sum(m in sys.modules for m in "
+                "['numba', 'nibabel', 'scipy', 'sklearn']))")
+        out = subprocess.check_output([sys.executable, '-c', code])
+        return int(out.decode().splitlines()[-1])
@@ -2,3 +2,10 @@ from __future__ import absolute_import, division, print_function
 from .version import __version__  # noqa
 from .recon import *  # noqa
 from .mri import *  # noqa
+from .operators import *  # noqa
+from .ridge import *  # noqa
+from .model import *  # noqa
+from .cache import *  # noqa
+from .profiling import *  # noqa
+from .grid import *  # noqa
+from .prf import *  # noqa
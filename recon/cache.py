@@ -0,0 +1,138 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+__all__ = ["BasisCache"]
+
+
+class BasisCache(object):
+    """content-addressed on-disk cache of receptive field bases
+
+    Entries are sets of named arrays stored as ``.npy`` files in a
+    directory per key. Cached arrays are memory-mapped (read-only) on reuse,
+    so worker processes sharing a cache directory also share the page
+    cache. When the total size exceeds ``max_bytes`` the least recently used
+    entries are evicted.
+
+    Parameters
+    ----------
+    directory : string | None
+        Cache directory (default=None). Defaults to the ``RECON_CACHE_DIR``
+        environment variable or ``~/.cache/recon``.
+    max_bytes : int
+        Maximum total size of the cache in bytes (default=2**30).
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> cache = BasisCache('/tmp/recon_cache')
+    >>> model = ReconstructionModel(x0, y0, s0, method='multivariate',
+    ...                             cache=cache).fit()
+    """
+
+    def __init__(self, directory=None, max_bytes=2**30):
+        if directory is None:
+            directory = os.environ.get(
+                'RECON_CACHE_DIR',
+                os.path.join(os.path.expanduser('~'), '.cache', 'recon'))
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*args):
+        """hash of pRF parameters, grid and solver settings"""
+        h = hashlib.sha1()
+        for arg in args:
+            if isinstance(arg, np.ndarray) or isinstance(arg, (list, tuple)):
+                arg = np.ascontiguousarray(arg, dtype=np.float64)
+                h.update(repr(arg.shape).encode())
+                h.update(arg.tobytes())
+            else:
+                h.update(repr(arg).encode())
+            h.update(b'|')
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, names=None):
+        """memory-mapped arrays of an entry, or None if not cached
+
+        Parameters
+        ----------
+        key : string
+            Entry key, see ``BasisCache.key``.
+        names : sequence of strings | None
+            Names of the arrays to load (default=None, i.e. all arrays). An
+            entry lacking any of them, e.g. while it is evicted by another
+            process, is treated as not cached.
+        """
+        path = self._path(key)
+        try:
+            if names is None:
+                names = [f[:-4] for f in os.listdir(path)
+                         if f.endswith('.npy')]
+            arrays = dict((name, np.load(os.path.join(path, name + '.npy'),
+                                         mmap_mode='r')) for name in names)
+            # mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return arrays
+
+    def put(self, key, arrays):
+        """store a dict of arrays under ``key`` and evict old entries"""
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created concurrently
+                pass
+
+        # write to a temporary directory first, renaming is atomic so
+        # concurrent workers never see partial entries
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp')
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), array)
+        try:
+            os.rename(tmp, self._path(key))
+        except OSError:  # entry was written by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+    def size(self):
+        """total size of all entries in bytes"""
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f))
+                           for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), key, size))
+            except OSError:  # evicted concurrently
+                continue
+        return entries
+
+    def evict(self):
+        """remove least recently used entries until within ``max_bytes``"""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """remove all entries"""
+        for _, key, _ in self._entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
@@ -0,0 +1,209 @@
+from collections import OrderedDict
+import numpy as np
+
+__all__ = ["VisualFieldGrid", "get_grid", "PointGrid", "log_polar_grid"]
+
+
+class VisualFieldGrid(object):
+    """regular grid of pixel positions in the visual field
+
+    Only the 1D coordinate vectors are stored; the full meshgrid is never
+    needed because receptive fields broadcast over them. Instances are
+    immutable, use ``get_grid`` to share them across calls.
+
+    Parameters
+    ----------
+    extent : scalars (left, right, bottom, top), default: [-8, 8, -8, 8]
+         Screen dimensions in visual degrees.
+    resolution : float
+         Interpolation steps in visual degrees (default=0.5).
+
+    Attributes
+    ----------
+    xv : array, shape(xdim, )
+        x-coordinates of the pixel columns (left to right).
+    yv : array, shape(ydim, )
+        y-coordinates of the pixel rows (top to bottom).
+
+    Examples
+    --------
+    >>> grid = VisualFieldGrid([-8, 8, -8, 8], resolution=0.25)
+    >>> grid.shape
+    (64, 64)
+    >>> G = gaussian_receptive_field(x0=1., y0=3., s0=1., grid=grid)
+    """
+
+    __slots__ = ('extent', 'resolution', 'xv', 'yv')
+
+    def __init__(self, extent=[-8, 8, -8, 8], resolution=0.5):
+        extent = tuple(float(e) for e in extent)
+        resolution = float(resolution)
+
+        xmin, xmax, ymin, ymax = extent
+        xv = np.arange(xmin, xmax, resolution)
+        yv = np.arange(ymin, ymax, resolution)[::-1].copy()
+        # shared between callers, protect against accidental modification
+        xv.flags.writeable = False
+        yv.flags.writeable = False
+
+        object.__setattr__(self, 'extent', extent)
+        object.__setattr__(self, 'resolution', resolution)
+        object.__setattr__(self, 'xv', xv)
+        object.__setattr__(self, 'yv', yv)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('VisualFieldGrid is immutable')
+
+    def __reduce__(self):
+        return (VisualFieldGrid, (self.extent, self.resolution))
+
+    def __repr__(self):
+        return 'VisualFieldGrid(extent=%s, resolution=%s)' % (
+            list(self.extent), self.resolution)
+
+    @property
+    def shape(self):
+        """image shape (ydim, xdim)"""
+        return (self.yv.shape[0], self.xv.shape[0])
+
+    @property
+    def size(self):
+        """number of pixels"""
+        return self.yv.shape[0] * self.xv.shape[0]
+
+    def coordinates(self):
+        """x and y coordinates that broadcast to ``shape``"""
+        return self.xv[np.newaxis, :], self.yv[:, np.newaxis]
+
+
+class PointGrid(object):
+    """arbitrary set of points in the visual field
+
+    Nonuniform grids, e.g. log-polar grids that are dense in the fovea and
+    sparse in the periphery, resolve small foveal receptive fields with a
+    fraction of the pixels of a regular grid. Images on a point grid are 1D
+    arrays with one value per point.
+
+    Parameters
+    ----------
+    x : array, shape(n_points, )
+        x-coordinates in visual degrees.
+    y : array, shape(n_points, )
+        y-coordinates in visual degrees.
+
+    Examples
+    --------
+    >>> grid = PointGrid([0., 1., 2.], [0., 0., 1.])
+    >>> G = gaussian_receptive_field(x0=1., y0=0., s0=1., grid=grid)
+    >>> G.shape
+    (3,)
+    """
+
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        x, y = [np.array(v, dtype=float).ravel() for v in (x, y)]
+        if x.shape != y.shape:
+            raise ValueError('x and y must have the same number of points')
+        x.flags.writeable = False
+        y.flags.writeable = False
+
+        object.__setattr__(self, 'x', x)
+        object.__setattr__(self, 'y', y)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PointGrid is immutable')
+
+    def __reduce__(self):
+        return (PointGrid, (self.x, self.y))
+
+    def __repr__(self):
+        return 'PointGrid(n_points=%s)' % self.size
+
+    @property
+    def shape(self):
+        """image shape (n_points, )"""
+        return self.x.shape
+
+    @property
+    def size(self):
+        """number of points"""
+        return self.x.shape[0]
+
+    def coordinates(self):
+        """x and y coordinates that broadcast to ``shape``"""
+        return self.x, self.y
+
+
+def log_polar_grid(max_eccentricity=8., n_eccentricity=32, n_angle=64,
+                   e2=0.5):
+    """point grid with spacing proportional to eccentricity
+
+    Rings are spaced logarithmically in ``eccentricity + e2``, following the
+    cortical magnification M(E) ~ 1 / (E + e2), hence every ring (and every
+    angular step) covers about the same amount of cortex. The first ring is
+    the single point at the center of gaze.
+
+    Parameters
+    ----------
+    max_eccentricity : float
+        Eccentricity of the outermost ring in visual degrees (default=8.).
+    n_eccentricity : int
+        Number of rings, including the center (default=32).
+    n_angle : int
+        Number of points per ring (default=64).
+    e2 : float
+        Eccentricity at which the magnification halves, in visual degrees
+        (default=0.5). Smaller values concentrate more points in the fovea.
+
+    Returns
+    -------
+    grid : PointGrid
+        ``1 + (n_eccentricity - 1) * n_angle`` points.
+
+    Examples
+    --------
+    >>> grid = log_polar_grid(8., n_eccentricity=24, n_angle=48)
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> S = stimulus_reconstruction(x0, y0, s0, betas, grid=grid)
+    """
+    ecc = np.geomspace(e2, max_eccentricity + e2, n_eccentricity)[1:] - e2
+    angle = np.arange(n_angle) * 2 * np.pi / n_angle
+    x = np.outer(ecc, np.cos(angle)).ravel()
+    y = np.outer(ecc, np.sin(angle)).ravel()
+    return PointGrid(np.r_[0., x], np.r_[0., y])
+
+
+_grid_cache = OrderedDict()
+_grid_cache_size = 32
+
+
+def get_grid(extent=[-8, 8, -8, 8], resolution=0.5):
+    """cached ``VisualFieldGrid`` for ``extent`` and ``resolution``
+
+    The most recently used grids are kept, so repeated calls with the same
+    screen do no grid work at all.
+    """
+    key = (tuple(float(e) for e in extent), float(resolution))
+    grid = _grid_cache.pop(key, None)
+    if grid is None:
+        grid = VisualFieldGrid(*key)
+        if len(_grid_cache) >= _grid_cache_size:
+            _grid_cache.popitem(last=False)
+    _grid_cache[key] = grid
+    return grid
+
+
+def _resolve_grid(grid, extent, resolution, points=False):
+    """grid argument of the RF functions, or the cached extent grid
+
+    Point grids are only accepted if ``points`` is True.
+    """
+    if grid is None:
+        return get_grid(extent, resolution)
+    if points and isinstance(grid, PointGrid):
+        return grid
+    if not isinstance(grid, VisualFieldGrid):
+        raise TypeError('grid must be a VisualFieldGrid%s, got %r'
+                        % (' or PointGrid' if points else '', grid))
+    return grid
@@ -0,0 +1,246 @@
+import functools
+import numpy as np
+
+__all__ = []
+
+try:
+    from importlib.util import find_spec
+    HAS_NUMBA = find_spec('numba') is not None
+except ImportError:  # pragma: no cover, python 2
+    import imp
+    try:
+        imp.find_module('numba')
+        HAS_NUMBA = True
+    except ImportError:
+        HAS_NUMBA = False
+
+# replaced by numba.prange when the kernels are compiled
+prange = range
+
+
+def _compile(func, options):
+    if not HAS_NUMBA:
+        return func
+
+    import numba
+    if 'prange' in func.__globals__:
+        func.__globals__['prange'] = numba.prange
+    return numba.jit(**options)(func)
+
+
+def jit(*args, **options):
+    """``numba.jit`` that defers importing numba until the first call
+
+    Importing numba (and LLVM) is slow, so the kernels are only compiled
+    when they are used. Without numba the python function is returned.
+    """
+    def decorator(func):
+        compiled = []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not compiled:
+                compiled.append(_compile(func, options))
+            return compiled[0](*args, **kwargs)
+
+        wrapper.py_func = func
+        return wrapper
+
+    if len(args) == 1 and callable(args[0]) and not options:
+        return decorator(args[0])
+    return decorator
+
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def _summation_kernel(x0, y0, s0, B, xv, yv, out):
+    n_voxel, n_targets = B.shape
+    xdim, ydim = xv.shape[0], yv.shape[0]
+    # separable receptive fields, only O(n_voxel * (xdim + ydim)) exp calls
+    gx = np.empty((n_voxel, xdim), dtype=out.dtype)
+    gy = np.empty((n_voxel, ydim), dtype=out.dtype)
+    for v in prange(n_voxel):
+        s_factor2 = 2. * s0[v]**2
+        for j in range(xdim):
+            gx[v, j] = np.exp(-(xv[j] - x0[v])**2 / s_factor2)
+        for i in range(ydim):
+            gy[v, i] = np.exp(-(yv[i] - y0[v])**2 / s_factor2)
+
+    # every thread owns a block of pixel rows, hence no write conflicts. The
+    # rows are accumulated in cache and every profile along x is read once
+    # per block.
+    n_rows = 16
+    for block in prange((ydim + n_rows - 1) // n_rows):
+        start = block * n_rows
+        stop = min(start + n_rows, ydim)
+        acc = np.empty((stop - start, xdim), dtype=out.dtype)
+        for t in range(n_targets):
+            acc[:] = 0
+            for v in range(n_voxel):
+                for i in range(start, stop):
+                    w = B[v, t] * gy[v, i]
+                    if w != 0:
+                        for j in range(xdim):
+                            acc[i - start, j] += w * gx[v, j]
+            out[t, start:stop] = acc
+    return out
+
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def _design_kernel(x0, y0, s0, xv, yv, out):
+    n_voxel = x0.shape[0]
+    xdim = xv.shape[0]
+    for v in prange(n_voxel):
+        s_factor2 = 2. * s0[v]**2
+        gx = np.empty(xdim, dtype=out.dtype)
+        for j in range(xdim):
+            gx[j] = np.exp(-(xv[j] - x0[v])**2 / s_factor2)
+        for i in range(yv.shape[0]):
+            gy = np.exp(-(yv[i] - y0[v])**2 / s_factor2)
+            for j in range(xdim):
+                out[v, i * xdim + j] = gy * gx[j]
+    return out
+
+
+def _as_float_arrays(dtype, *arrays):
+    return [np.ascontiguousarray(a, dtype=dtype) for a in arrays]
+
+
+def rf_summation(x0, y0, s0, B, xv, yv, dtype=np.float64):
+    """sum of beta-weighted receptive fields, shape(n_targets, ydim, xdim)
+
+    Runs the parallel numba kernel across all cores, or falls back to the
+    separable NumPy implementation if numba is not installed.
+    """
+    B = np.asarray(B, dtype=dtype).reshape(len(x0), -1)
+    if HAS_NUMBA:
+        x0, y0, s0, B, xv, yv = _as_float_arrays(dtype, x0, y0, s0, B, xv,
+                                                 yv)
+        out = np.zeros((B.shape[1], yv.shape[0], xv.shape[0]), dtype=dtype)
+        _summation_kernel(x0, y0, s0, B, xv, yv, out)
+        return out
+
+    from .operators import _gaussian_profiles
+    gx, gy = _gaussian_profiles(x0, y0, s0, xv, yv, dtype)
+    S = np.einsum('vi,vt,vj->tij', gy, B, gx)
+    return S
+
+
+def rf_design_matrix(x0, y0, s0, xv, yv, dtype=np.float64):
+    """dense receptive field design matrix, shape(n_voxel, ydim * xdim)
+
+    Rows are filled in parallel by the numba kernel, or by the separable
+    NumPy implementation if numba is not installed.
+    """
+    if HAS_NUMBA:
+        x0, y0, s0, xv, yv = _as_float_arrays(dtype, x0, y0, s0, xv, yv)
+        out = np.empty((x0.shape[0], yv.shape[0] * xv.shape[0]), dtype=dtype)
+        _design_kernel(x0, y0, s0, xv, yv, out)
+        return out
+
+    from .operators import _gaussian_profiles
+    gx, gy = _gaussian_profiles(x0, y0, s0, xv, yv, dtype)
+    return (gy[:, :, np.newaxis] * gx[:, np.newaxis, :]).reshape(
+        gx.shape[0], -1)
+
+
+def _sigma_bins(s, n_bins):
+    """receptive field sizes as interpolation between ``n_bins`` widths
+
+    Returns the widths, the lower width index of every voxel and the weight
+    of the upper width. Sizes are used as they are if there are at most
+    ``n_bins`` distinct values, otherwise they are linearly interpolated
+    between log-spaced widths.
+    """
+    unique = np.unique(s)
+    if unique.shape[0] <= n_bins:
+        return unique, np.searchsorted(unique, s), np.zeros_like(s)
+
+    log_widths = np.linspace(np.log(unique[0]), np.log(unique[-1]), n_bins)
+    pos = (np.log(s) - log_widths[0]) / (log_widths[1] - log_widths[0])
+    lower = np.clip(np.floor(pos).astype(int), 0, n_bins - 2)
+    return np.exp(log_widths).astype(s.dtype), lower, pos - lower
+
+
+def rf_summation_fft(x0, y0, s0, B, grid, n_bins=16, truncate=4.,
+                     dtype=np.float64):
+    """sum of beta-weighted receptive fields by convolution
+
+    The summation is a convolution of beta-weighted impulses at the
+    receptive field centers with a gaussian per receptive field size. Sizes
+    are quantized into ``n_bins`` widths and the betas are splatted onto
+    the grid with bilinear weights (and linear weights across widths).
+    Every width is convolved with its gaussian via FFT, so the cost scales
+    with the number of pixels and widths instead of voxels times pixels.
+    Accurate for receptive fields larger than the pixel spacing, all sizes
+    must be positive.
+
+    Returns
+    -------
+    S : array, shape(n_targets, ydim, xdim)
+    """
+    from scipy import fft, sparse
+
+    x0, y0, s0 = [np.atleast_1d(np.asarray(p, dtype=dtype))
+                  for p in (x0, y0, s0)]
+    if np.any(~(s0 > 0)):
+        raise ValueError("the fft engine requires positive s0, select the "
+                         "voxels with select_prf first")
+    n_voxel = x0.shape[0]
+    B = np.asarray(B, dtype=dtype).reshape(n_voxel, -1)
+
+    res = grid.resolution
+    widths, lower, w_upper = _sigma_bins(s0 / res, n_bins)
+
+    # the padding keeps receptive fields centered off-screen and absorbs the
+    # wrap-around of the circular convolution
+    pad = int(np.ceil(truncate * widths.max()))
+    ydim, xdim = grid.shape
+    height = fft.next_fast_len(ydim + 2 * pad, True)
+    width = fft.next_fast_len(xdim + 2 * pad, True)
+
+    # fractional pixel coordinates, rows run from top to bottom
+    fx = (x0 - grid.xv[0]) / res + pad
+    fy = (grid.yv[0] - y0) / res + pad
+    j, i = np.floor(fx).astype(int), np.floor(fy).astype(int)
+    dx, dy = fx - j, fy - i
+
+    bins, pixels, voxels, weights = [], [], [], []
+    for db, wb in ((0, 1 - w_upper), (1, w_upper)):
+        for di, wi in ((0, 1 - dy), (1, dy)):
+            for dj, wj in ((0, 1 - dx), (1, dx)):
+                w = wb * wi * wj
+                rows_inside = (i + di >= 0) & (i + di < height)
+                cols_inside = (j + dj >= 0) & (j + dj < width)
+                inside = rows_inside & cols_inside & (w != 0)
+                bins.append((lower + db)[inside])
+                pixels.append(((i + di) * width + j + dj)[inside])
+                voxels.append(np.flatnonzero(inside))
+                weights.append(w[inside])
+    bins, pixels, voxels, weights = [np.concatenate(a) for a in
+                                     (bins, pixels, voxels, weights)]
+
+    def kernel(n, sigma):
+        # circular gaussian kernel, truncated to fit into the padding
+        d = np.arange(n)
+        d = np.minimum(d, n - d)
+        k = np.exp(-d**2 / (2 * sigma**2))
+        k[d > min(pad, int(np.ceil(truncate * sigma)))] = 0
+        return k
+
+    # convolution theorem, the spectra are summed across widths so a single
+    # inverse transform is needed
+    spectrum = 0
+    for b, sigma in enumerate(widths):
+        sel = bins == b
+        if not sel.any():
+            continue
+        splat = sparse.csr_matrix(
+            (weights[sel], (pixels[sel], voxels[sel])),
+            shape=(height * width, n_voxel))
+        impulses = splat.dot(B).T.reshape(-1, height, width)
+        Ky = fft.fft(kernel(height, sigma)).real
+        Kx = fft.rfft(kernel(width, sigma)).real
+        K = Ky[:, np.newaxis] * Kx
+        spectrum = spectrum + fft.rfft2(impulses, workers=-1) * K
+    S = fft.irfft2(spectrum, s=(height, width), workers=-1)
+    return S[:, pad:pad + ydim, pad:pad + xdim].astype(dtype, copy=False)
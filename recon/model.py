@@ -0,0 +1,463 @@
+import numpy as np
+from .cache import BasisCache
+from .kernels import rf_design_matrix, rf_summation, rf_summation_fft
+from .grid import VisualFieldGrid, _resolve_grid, get_grid
+from .operators import (AnalyticRFMatrix, PointRFMatrix, SeparableRFMatrix,
+                        _gaussian_profiles)
+from .prf import _prf_arrays
+from .profiling import stage
+from .ridge import IterativeRidge, RidgeGCV, _rmatvec
+
+__all__ = ["ReconstructionModel", "Reconstruction"]
+
+
+class ReconstructionModel(object):
+    """prf-based stimulus reconstruction with a cached receptive field basis
+
+    ``fit`` builds the receptive field basis (and, for the ``multivariate``
+    method, the eigendecomposition of the ridge problem) once. Afterwards
+    ``reconstruct`` turns any number of activation patterns into images
+    without touching the pRF parameters again.
+
+    Parameters
+    ----------
+    x0 : array, shape(n_voxel, ) | PRFSet
+         Centers of gaussian in visual degrees, or a ``PRFSet`` holding all
+         pRF parameters (``y0`` and ``s0`` are omitted then).
+    y0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    s0 : array, shape(n_voxel, )
+         Sizes/sigmas of gaussian in visual degrees.
+    extent : scalars (left, right, bottom, top), default: [-8, 8, -8, 8]
+         Screen dimensions in visual degrees.
+    resolution : float
+         Interpolation steps in visual degrees (default=0.5).
+    method : string ['summation'|'multivariate']
+        Reconstruction method to use (default='summation').
+    clf : class
+        Classifier for ``multivariate`` method (default=None). If None, the
+        estimator is chosen by ``solver``.
+    alpha : float | None
+        Fixed ridge regularization for the default ``multivariate`` solver
+        (default=None). Iterative solvers use 10. if None.
+    solver : string ['dense'|'analytic'|'lsqr'|'cg']
+        Solver of the default ``multivariate`` estimator (default='dense').
+        ``'dense'`` is a ``RidgeGCV`` selecting the regularization per trial,
+        ``'analytic'`` the same in voxel space with the closed-form Gram
+        matrix of ``AnalyticRFMatrix``. ``'lsqr'`` and ``'cg'`` are
+        matrix-free ``IterativeRidge`` solvers with warm starts across
+        trials.
+    tol : float
+        Tolerance of the iterative solvers (default=1e-6).
+    chunk_size : int | None
+        Voxel rows per design matrix block (default=None). Decomposes the
+        (n_pixel, n_pixel) Gram matrix of a ``RidgeGCV``.
+    max_memory : int | None
+        Memory budget in bytes of a design matrix block or of the
+        decomposition workspace of a (n_voxel, n_voxel) ``RidgeGCV`` kernel
+        (default=None). The kernel is only used if it fits the budget. Not
+        a bound of the total memory, the (n_pixel, n_pixel) Gram matrix and
+        the reconstructions come on top.
+    engine : string ['blas'|'numba'|'fft']
+        Compute the ``summation`` method, and the dense design matrix of a
+        custom ``clf``, from separable profiles with matrix products
+        (``'blas'``) or with parallel numba kernels (``'numba'``, falls back
+        to ``'blas'`` without numba). The default ``multivariate`` solvers
+        always work on the separable profiles. ``'fft'`` computes the
+        ``summation`` method as a convolution of the betas with gaussians of
+        ``n_bins`` quantized sizes, its cost scales with the number of
+        pixels instead of voxels times pixels and it requires positive
+        ``s0``. Default='blas'.
+    cache : BasisCache | string | None
+        Cache (or cache directory) to store and memory-map receptive field
+        profiles and ridge decompositions across processes (default=None).
+    grid : VisualFieldGrid | PointGrid | None
+        Grid to use instead of ``extent`` and ``resolution`` (default=None).
+        Images on a ``PointGrid`` have shape(n_points, ), point grids
+        require the ``'blas'`` engine.
+    truncate : float | None
+        Truncate receptive fields at ``truncate * s0`` and use a sparse
+        design matrix (default=None, i.e. dense gaussians).
+    dtype : dtype
+        Floating point type of the basis, the ridge solution and the
+        reconstructions (default=np.float64). ``np.float32`` halves memory
+        and bandwidth at a relative precision of about 1e-6.
+    n_bins : int
+        Number of receptive field sizes of the ``'fft'`` engine
+        (default=16). Sizes are exact if there are at most ``n_bins``
+        distinct values.
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> model = ReconstructionModel(x0, y0, s0, method='multivariate').fit()
+    >>> trials = np.random.normal(size=(20, x0.shape[0]))
+    >>> S = model.reconstruct(trials)
+    >>> S.shape
+    (20, 32, 32)
+    """
+
+    def __init__(self, x0, y0=None, s0=None, extent=[-8, 8, -8, 8],
+                 resolution=0.5, method='summation', clf=None, alpha=None,
+                 chunk_size=None, max_memory=None, engine='blas', cache=None,
+                 grid=None, truncate=None, solver='dense', tol=1e-6,
+                 dtype=np.float64, n_bins=16):
+        x0, y0, s0 = _prf_arrays(x0, y0, s0)
+        if not np.shape(x0) == np.shape(y0) == np.shape(s0):
+            raise ValueError('x0, y0 and s0 must have the same shape, got '
+                             '%s, %s and %s' % (np.shape(x0), np.shape(y0),
+                                                np.shape(s0)))
+
+        self.x0 = x0
+        self.y0 = y0
+        self.s0 = s0
+        self.extent = extent
+        self.resolution = resolution
+        self.method = method
+        self.clf = clf
+        self.alpha = alpha
+        self.chunk_size = chunk_size
+        self.max_memory = max_memory
+        self.engine = engine
+        self.n_bins = n_bins
+        self.cache = cache
+        self.grid = grid
+        self.truncate = truncate
+        self.solver = solver
+        self.tol = tol
+        self.dtype = dtype
+
+    def fit(self):
+        """precompute the receptive field basis"""
+        if self.method not in ('summation', 'multivariate'):
+            raise NotImplementedError('Method not implemented')
+        if self.engine not in ('blas', 'numba', 'fft'):
+            raise NotImplementedError('Engine not implemented')
+        if self.engine != 'blas' and self.truncate is not None:
+            raise ValueError('truncate is not supported by the %s engine'
+                             % self.engine)
+        if self.solver == 'analytic' and self.truncate is not None:
+            raise ValueError('truncate is not supported by the analytic '
+                             'solver')
+        if self.engine == 'fft' and np.any(~(np.asarray(self.s0) > 0)):
+            raise ValueError("the fft engine requires positive s0, select "
+                             "the voxels with select_prf first")
+
+        cache = self.cache
+        if cache is not None and not isinstance(cache, BasisCache):
+            cache = BasisCache(cache)
+        with stage('reconstruction.grid') as st:
+            grid = _resolve_grid(self.grid, self.extent, self.resolution,
+                                 points=True)
+            x, y = grid.coordinates()
+            st.record(x=x, y=y)
+
+        regular = isinstance(grid, VisualFieldGrid)
+        if not regular and self.engine != 'blas':
+            raise ValueError('the %s engine requires a VisualFieldGrid'
+                             % self.engine)
+        if not regular and self.solver == 'analytic':
+            raise ValueError('the analytic solver requires a VisualFieldGrid')
+
+        grid_key = ((grid.extent, grid.resolution) if regular
+                    else ((grid.x, grid.y), ))
+        prf_key = (self.x0, self.y0, self.s0) + grid_key
+        prf_key += (np.dtype(self.dtype).str, )
+
+        with stage('reconstruction.rf_basis') as st:
+            if not regular:
+                # receptive fields do not factorize on nonuniform grids,
+                # they are evaluated block by block when needed
+                X = PointRFMatrix(self.x0, self.y0, self.s0, grid,
+                                  self.dtype)
+            else:
+                gx, gy = self._profiles(grid, cache, prf_key)
+                st.record(gx=gx, gy=gy)
+                if self.method == 'multivariate' and \
+                        self.solver == 'analytic':
+                    X = AnalyticRFMatrix.from_profiles(gx, gy, grid, self.x0,
+                                                       self.y0, self.s0)
+                else:
+                    X = SeparableRFMatrix.from_profiles(gx, gy, grid)
+
+        self.grid_ = grid
+        self.image_shape_ = X.image_shape
+        self.n_voxel_ = X.n_voxel
+
+        if self.truncate is not None:
+            with stage('reconstruction.sparse_basis') as st:
+                X = X.tosparse(self.truncate)
+                st.record(data=X.data, indices=X.indices)
+
+        if self.method == 'summation':
+            self.basis_ = X
+        else:
+            clf = self.clf
+            if clf is None and self.solver in ('dense', 'analytic'):
+                mode = 'dual' if self.solver == 'analytic' else 'auto'
+                clf = RidgeGCV(alpha_per_target=True, mode=mode)
+                if self.alpha is not None:
+                    clf.alphas = [self.alpha]
+            elif clf is None and self.solver in ('lsqr', 'cg'):
+                alpha = 10. if self.alpha is None else self.alpha
+                clf = IterativeRidge(alpha, solver=self.solver, tol=self.tol)
+            elif clf is None:
+                raise NotImplementedError('Solver not implemented')
+
+            if isinstance(clf, IterativeRidge):
+                self.basis_ = X
+            elif isinstance(clf, RidgeGCV):
+                with stage('reconstruction.ridge_decompose'):
+                    self._decompose(clf, X, cache, prf_key)
+                self.basis_ = X
+            elif self.chunk_size is not None or self.max_memory is not None:
+                raise ValueError('chunk_size/max_memory require a RidgeGCV '
+                                 'clf')
+            else:
+                with stage('reconstruction.design_matrix') as st:
+                    if self.truncate is not None:
+                        self.basis_ = X
+                    elif self.engine == 'numba':
+                        self.basis_ = rf_design_matrix(
+                            self.x0, self.y0, self.s0, X.xv, X.yv,
+                            self.dtype)
+                    else:
+                        self.basis_ = X.todense()
+                    st.record(X=self.basis_)
+            self.clf_ = clf
+
+        return self
+
+    def _profiles(self, grid, cache, prf_key):
+        """separable receptive field profiles, from the cache if possible"""
+        if cache is not None:
+            key = cache.key('profiles', *prf_key)
+            profiles = cache.get(key, ('gx', 'gy'))
+            if profiles is not None:
+                return profiles['gx'], profiles['gy']
+
+        gx, gy = _gaussian_profiles(self.x0, self.y0, self.s0, grid.xv,
+                                    grid.yv, self.dtype)
+        if cache is not None:
+            cache.put(key, {'gx': gx, 'gy': gy})
+        return gx, gy
+
+    def _decompose(self, clf, X, cache, prf_key):
+        if cache is None:
+            clf.decompose(X, chunk_size=self.chunk_size,
+                          max_memory=self.max_memory)
+            return
+
+        names = clf.decomposition_names(X, self.chunk_size, self.max_memory)
+        # the arrays identify the decomposed matrix
+        key = cache.key('ridge', *(prf_key + (
+            clf.alphas, clf.fit_intercept, ','.join(names), self.truncate,
+            type(X).__name__)))
+        arrays = cache.get(key, names)
+        if arrays is None:
+            clf.decompose(X, chunk_size=self.chunk_size,
+                          max_memory=self.max_memory)
+            cache.put(key, clf.get_decomposition())
+        else:
+            clf.set_decomposition(X, arrays)
+
+    def reconstruct(self, betas, lazy=False):
+        """reconstruct images from voxel activations
+
+        Parameters
+        ----------
+        betas : array, shape(n_voxel, ) **or** shape(n_trials, n_voxel)
+            Voxel activations.
+        lazy : bool
+            Return a ``Reconstruction`` that evaluates the image(s) on
+            demand instead of pixels (default=False).
+
+        Returns
+        -------
+        S : array, shape(ydim, xdim) **or** shape(n_trials, ydim, xdim)
+            Reconstructed image(s).
+        """
+        betas = np.asarray(betas, dtype=self.dtype)
+        B = np.atleast_2d(betas)
+        if B.shape[1] != self.n_voxel_:
+            raise ValueError('betas has %s voxels, model has %s'
+                             % (B.shape[1], self.n_voxel_))
+
+        if lazy:
+            with stage('reconstruction.weights') as st:
+                W = self._voxel_weights(B)
+                st.record(W=W)
+            return Reconstruction(self.x0, self.y0, self.s0,
+                                  W[:, 0] if betas.ndim == 1 else W,
+                                  self.grid_, self.truncate)
+
+        with stage('reconstruction.' + self.method) as st:
+            if self.method == 'summation' and self.engine == 'numba':
+                X = self.basis_
+                S = rf_summation(self.x0, self.y0, self.s0, B.T, X.xv, X.yv,
+                                 self.dtype)
+                S = S.reshape(B.shape[0], -1) / self.n_voxel_
+
+            elif self.method == 'summation' and self.engine == 'fft':
+                S = rf_summation_fft(self.x0, self.y0, self.s0, B.T,
+                                     self.basis_.grid, self.n_bins,
+                                     dtype=self.dtype)
+                S = S.reshape(B.shape[0], -1) / self.n_voxel_
+
+            elif self.method == 'summation':
+                # blocked products of the separable basis with all trials
+                S = _rmatvec(self.basis_, B.T).T / self.n_voxel_
+
+            elif isinstance(self.clf_, RidgeGCV):
+                S = np.atleast_2d(self.clf_.solve(B.T).coef_)
+
+            elif isinstance(self.clf_, IterativeRidge):
+                S = np.atleast_2d(self.clf_.fit(self.basis_, B.T).coef_)
+
+            else:
+                S = np.empty((B.shape[0], self.basis_.shape[1]),
+                             dtype=self.dtype)
+                for i in range(B.shape[0]):
+                    S[i] = self.clf_.fit(self.basis_, B[i]).coef_
+            st.record(S=S)
+
+        S = S.reshape((B.shape[0], ) + self.image_shape_)
+        return S[0] if betas.ndim == 1 else S
+
+    def _voxel_weights(self, B):
+        """weights of the receptive fields that sum up to the images"""
+        if self.method == 'summation':
+            return B.T / self.n_voxel_
+        if isinstance(self.clf_, RidgeGCV):
+            return np.atleast_2d(self.clf_.solve(B.T).dual_coef_.T).T
+        if isinstance(self.clf_, IterativeRidge):
+            return np.atleast_2d(
+                self.clf_.fit(self.basis_, B.T).dual_coef_.T).T
+        raise ValueError('lazy reconstructions require a RidgeGCV or '
+                         'IterativeRidge clf')
+
+
+class Reconstruction(object):
+    """reconstructed image(s) as a weighted sum of receptive fields
+
+    Holds voxel weights and pRF parameters instead of pixels. The images are
+    evaluated on demand, on the grid of the reconstruction, on any other
+    extent or resolution, or on arbitrary points, so only the queried pixels
+    are paid for. ``np.asarray`` renders the full images.
+
+    Parameters
+    ----------
+    x0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    y0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    s0 : array, shape(n_voxel, )
+         Sizes/sigmas of gaussian in visual degrees.
+    weights : array, shape(n_voxel, ) **or** shape(n_voxel, n_trials)
+        Weight of every receptive field.
+    grid : VisualFieldGrid | PointGrid
+        Grid the reconstruction was computed on, the default for ``render``.
+    truncate : float | None
+        Receptive fields are truncated at ``truncate * s0`` (default=None).
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> rec = stimulus_reconstruction(x0, y0, s0, betas, lazy=True)
+    >>> fovea = rec.render(extent=[-1, 1, -1, 1], resolution=0.05)
+    >>> probes = rec.evaluate([0., 2.5], [0., -1.])
+    """
+
+    def __init__(self, x0, y0, s0, weights, grid, truncate=None):
+        self.x0 = np.atleast_1d(np.asarray(x0, dtype=float))
+        self.y0 = np.atleast_1d(np.asarray(y0, dtype=float))
+        self.s0 = np.atleast_1d(np.asarray(s0, dtype=float))
+        self.weights = np.asarray(weights)
+        self.grid = grid
+        self.truncate = truncate
+
+    @property
+    def shape(self):
+        """shape of the images on ``grid``"""
+        return self.weights.shape[1:] + self.grid.shape
+
+    def evaluate(self, x, y, chunk_size=4096):
+        """images at points ``(x, y)``
+
+        Parameters
+        ----------
+        x : array
+            x-coordinates in visual degrees.
+        y : array
+            y-coordinates in visual degrees, broadcast against ``x``.
+        chunk_size : int
+            Points evaluated at once (default=4096).
+
+        Returns
+        -------
+        S : array, shape(x.shape) **or** shape(n_trials, ) + x.shape
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        points = x.shape
+        x, y = x.ravel(), y.ravel()
+        W = self.weights.reshape(self.weights.shape[0], -1)
+
+        S = np.empty((x.shape[0], W.shape[1]),
+                     dtype=np.result_type(W, np.float32))
+        for start in range(0, x.shape[0], chunk_size):
+            dx = x[start:start + chunk_size, np.newaxis] - self.x0
+            dy = y[start:start + chunk_size, np.newaxis] - self.y0
+            G = np.exp(-(dx**2 + dy**2) / (2 * self.s0**2))
+            if self.truncate is not None:
+                radius = self.truncate * np.abs(self.s0)
+                G[(np.abs(dx) > radius) | (np.abs(dy) > radius)] = 0
+            S[start:start + chunk_size] = np.dot(G, W)
+
+        return S.T.reshape(self.weights.shape[1:] + points)
+
+    def render(self, extent=None, resolution=None, grid=None):
+        """images on a (sub-)extent and/or resolution
+
+        Parameters
+        ----------
+        extent : scalars (left, right, bottom, top) | None
+            Screen dimensions in visual degrees (default=None, the extent of
+            ``grid``).
+        resolution : float | None
+            Interpolation steps in visual degrees (default=None, the
+            resolution of ``grid``).
+        grid : VisualFieldGrid | PointGrid | None
+            Grid to use instead of ``extent`` and ``resolution``
+            (default=None).
+
+        Returns
+        -------
+        S : array, shape(ydim, xdim) **or** shape(n_trials, ydim, xdim)
+            Image(s), shape(n_points, ) **or** shape(n_trials, n_points) on
+            point grids.
+        """
+        if grid is None and extent is None and resolution is None:
+            grid = self.grid
+        elif grid is None:
+            if not isinstance(self.grid, VisualFieldGrid):
+                raise ValueError('point grids have no extent or resolution, '
+                                 'pass a grid')
+            grid = get_grid(self.grid.extent if extent is None else extent,
+                            self.grid.resolution if resolution is None
+                            else resolution)
+
+        dtype = np.result_type(self.weights, np.float32)
+        if isinstance(grid, VisualFieldGrid):
+            X = SeparableRFMatrix(self.x0, self.y0, self.s0, grid=grid,
+                                  dtype=dtype)
+        else:
+            X = PointRFMatrix(self.x0, self.y0, self.s0, grid, dtype)
+        if self.truncate is not None:
+            X = X.tosparse(self.truncate)
+        S = _rmatvec(X, self.weights).T
+        return S.reshape(self.weights.shape[1:] + grid.shape)
+
+    def __array__(self, dtype=None, copy=None):
+        S = self.render()
+        return S if dtype is None else S.astype(dtype)
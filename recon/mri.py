@@ -1,24 +1,174 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import os
 import numpy as np
-import nibabel as nib
+from .profiling import stage
 
-__all__ = ['load_mri', 'save_mri']
+__all__ = ['load_mri', 'save_mri', 'iter_mri', 'load_mri_many', 'Mask']
 
 
-def load_mri(func, mask):
+class Mask(object):
+    """binary brain mask with precomputed voxel indices
+
+    Reading the mask file and locating its voxels is done once, so repeated
+    loads/saves against the same region of interest skip the mask I/O.
+
+    Parameters
+    ----------
+    mask : string | ndarray, shape(x, y, z)
+        Path to binary mask (e.g. nifti) or mask array. Values > 0 are
+        regarded as brain tissue.
+    affine : ndarray, shape(4, 4) | None
+        Affine of a mask array (default=None, i.e. identity). The affine of a
+        mask file is read from its header.
+
+    Attributes
+    ----------
+    shape : tuple
+        Volume shape.
+    affine : ndarray, shape(4, 4)
+        Voxel to world mapping.
+    indices : ndarray, shape(n_voxel, )
+        Flat (C-order) indices of the mask voxels.
+
+    Examples
+    --------
+    >>> mask = Mask('V1_mask.nii.gz')
+    >>> ts = [load_mri(run, mask) for run in ['run1.nii.gz', 'run2.nii.gz']]
+    """
+
+    def __init__(self, mask, affine=None):
+        if isinstance(mask, Mask):
+            affine = mask.affine if affine is None else affine
+            m = mask.to_array()
+        elif isinstance(mask, np.ndarray):
+            m = mask
+        else:
+            import nibabel as nib
+
+            img = nib.load(mask)
+            affine = img.affine if affine is None else affine
+            m = np.asanyarray(img.dataobj)
+
+        self.shape = m.shape
+        self.affine = np.eye(4) if affine is None else np.asarray(affine)
+
+        # voxels in C-order (as with boolean indexing), with their flat
+        # indices in both memory layouts
+        nonzero = np.nonzero(m)
+        self.indices = np.ravel_multi_index(nonzero, self.shape)
+        self._indices_f = np.ravel_multi_index(nonzero, self.shape,
+                                               order='F')
+
+    @property
+    def n_voxel(self):
+        return self.indices.shape[0]
+
+    def to_array(self):
+        """boolean mask array"""
+        m = np.zeros(self.shape, dtype=bool)
+        np.put(m, self.indices, True)
+        return m
+
+    def take(self, data):
+        """masked voxels of a 3D volume or 4D block of volumes
+
+        Parameters
+        ----------
+        data : ndarray, shape(x, y, z) **or** shape(x, y, z, n_tps)
+
+        Returns
+        -------
+        ts : ndarray, shape(n_voxel, ) **or** shape(n_voxel, n_tps)
+        """
+        data = np.asanyarray(data)
+        if data.shape[:3] != self.shape:
+            raise ValueError('data of shape %s does not match mask of shape '
+                             '%s' % (data.shape, self.shape))
+        n_tps = data.shape[3:]
+        # nifti data is Fortran ordered, reshaping it in that order is free
+        if data.flags.f_contiguous and not data.flags.c_contiguous:
+            flat = data.reshape((-1, ) + n_tps, order='F')
+            return np.take(flat, self._indices_f, axis=0)
+        return np.take(data.reshape((-1, ) + n_tps), self.indices, axis=0)
+
+
+def _load_func(func):
+    """data proxy of an image, volumes are read on demand"""
+    import nibabel as nib
+
+    # uncompressed images are memory-mapped; keeping (gzip) files open
+    # lets consecutive reads continue decompressing where the last stopped
+    return nib.load(func, mmap=True, keep_file_open=True).dataobj
+
+
+def iter_mri(func, mask, chunk_tps=50):
+    """iterate over blocks of masked MRI voxel data
+
+    Only ``chunk_tps`` volumes are read (and decompressed) at a time, so
+    processing can start before the whole run is read.
+
+    Parameters
+    ----------
+    func : string
+        Path to imaging data (e.g. nifti).
+    mask : string | Mask
+        Path to binary mask (e.g. nifti) that defines brain regions. Values > 0
+        are regarded as brain tissue. Pass a ``Mask`` to reuse it.
+    chunk_tps : int
+        Number of timepoints per block (default=50).
+
+    Yields
+    ------
+    ts : ndarray, shape(n_voxel, chunk_tps)
+        Timeseries of the next block of timepoints. The last block may be
+        shorter.
+
+    See Also
+    --------
+    load_mri: load MRI voxel data.
+
+    Examples
+    --------
+    >>> for ts in iter_mri('localizer.nii.gz', 'V1_mask.nii.gz'):
+    ...     S = stimulus_reconstruction(x0, y0, s0, ts)
+    """
+    return _iter_masked(func, _load_mask(mask), chunk_tps)
+
+
+def _load_mask(mask):
+    return mask if isinstance(mask, Mask) else Mask(mask)
+
+
+def _iter_masked(func, m, chunk_tps):
+    d = _load_func(func)
+    if len(d.shape) == 3:
+        yield m.take(d)[:, np.newaxis]
+        return
+
+    for t in range(0, d.shape[3], chunk_tps):
+        yield m.take(d[..., t:t + chunk_tps])
+
+
+def load_mri(func, mask, chunk_tps=1):
     """load MRI voxel data
 
-    The data is converted into a 2D (n_voxel, n_tps) array.
+    The data is converted into a 2D (n_voxel, n_tps) array. Only the masked
+    voxels are read, ``chunk_tps`` volumes at a time, so the full 4D volume
+    is never held in memory. The on-disk data type is kept (unless the image
+    defines a scaling).
 
     Parameters
     ----------
     func : string
         Path to imaging data (e.g. nifti).
-    mask : string
+    mask : string | Mask
         Path to binary mask (e.g. nifti) that defines brain regions. Values > 0
-        are regarded as brain tissue.
+        are regarded as brain tissue. Pass a ``Mask`` to reuse it.
+    chunk_tps : int
+        Number of volumes read at once (default=1). Larger blocks are faster
+        for compressed images at the cost of memory.
 
     Returns
     -------
@@ -28,50 +178,243 @@ def load_mri(func, mask):
     See Also
     --------
     save_mri: save MRI voxel data to disk.
+    iter_mri: iterate over blocks of MRI voxel data.
 
     Examples
     --------
     >>> ts = load_mri(func='localizer.nii.gz', mask='V1_mask.nii.gz')
     """
+    with stage('load_mri.mask') as st:
+        m = _load_mask(mask)
+        st.record(indices=m.indices)
 
-    # load mask data
-    m = nib.load(mask).get_data()
+    with stage('load_mri.read') as st:
+        n_tps = _load_func(func).shape[3:]
+        chunks = _iter_masked(func, m, chunk_tps)
+        if not n_tps:
+            func_data = next(chunks)[:, 0]
+        else:
+            # fill a preallocated array instead of concatenating the blocks
+            ts = next(chunks)
+            func_data = np.empty((ts.shape[0], n_tps[0]), dtype=ts.dtype)
+            t = 0
+            while ts is not None:
+                func_data[:, t:t + ts.shape[1]] = ts
+                t += ts.shape[1]
+                ts = next(chunks, None)
+        st.record(ts=func_data)
 
-    # load func data
-    d = nib.load(func).get_data()
+    return func_data
 
-    # mask the data
-    func_data = d[m != 0]
-    # nib.load(func).get_data()[nib.load(mask).get_data()!=0]
 
-    del d
+def _n_tps(d):
+    return d.shape[3] if len(d.shape) > 3 else 1
 
-    return func_data
 
+def _dtype(d):
+    """data type of the (scaled) image data, without reading the data"""
+    return np.asanyarray(d[..., :0]).dtype
+
+
+# mask shared with pool workers, set by _init_worker
+_worker_mask = None
+
+
+def _init_worker(m):
+    global _worker_mask
+    _worker_mask = m
+
+
+def _load_run(args):
+    """load one run into a memory-mapped output or return the data"""
+    i, func, chunk_tps, out = args
+    chunks = _iter_masked(func, _worker_mask, chunk_tps)
+    if out is None:
+        # fill a preallocated run instead of concatenating the blocks
+        ts = next(chunks)
+        res = np.empty((ts.shape[0], _n_tps(_load_func(func))),
+                       dtype=ts.dtype)
+        res[:, :ts.shape[1]] = ts
+        start = ts.shape[1]
+    else:
+        filename, dtype, shape, offset, start = out
+        res = np.memmap(filename, dtype=dtype, mode='r+', shape=shape,
+                        offset=offset)
+    for ts in chunks:
+        res[:, start:start + ts.shape[1]] = ts
+        start += ts.shape[1]
+    if out is None:
+        return i, res
+    res.flush()
+    return i, None
+
+
+def load_mri_many(funcs, mask, n_jobs=1, chunk_tps=50, out=None,
+                  mp_context=None):
+    """load and concatenate MRI voxel data of many runs in parallel
+
+    Runs are decoded in ``n_jobs`` worker processes and written into one
+    preallocated (n_voxel, total_tps) array. The mask is read only once.
 
-def save_mri(data, mask, fname=None):
+    Parameters
+    ----------
+    funcs : list of strings
+        Paths to imaging data (e.g. nifti) of all runs.
+    mask : string | Mask
+        Path to binary mask (e.g. nifti) that defines brain regions. Values > 0
+        are regarded as brain tissue. Pass a ``Mask`` to reuse it.
+    n_jobs : int
+        Number of worker processes (default=1). -1 uses all cores.
+    chunk_tps : int
+        Number of volumes read at once (default=50).
+    out : ndarray | np.memmap | None
+        Preallocated output of shape(n_voxel, total_tps) (default=None). If
+        ``out`` is a file-backed ``np.memmap``, workers write into it
+        directly instead of sending their data back.
+    mp_context : string | multiprocessing context | None
+        Start method (e.g. ``'forkserver'``) or context of the workers
+        (default=None, i.e. ``'spawn'``).
+
+    Returns
+    -------
+    ts : ndarray, shape(n_voxel, total_tps)
+        Timeseries of all runs, concatenated in time.
+
+    See Also
+    --------
+    load_mri: load MRI voxel data.
+
+    Notes
+    -----
+    Forking a process that runs threaded (numba/BLAS) code can deadlock,
+    hence workers are fresh interpreters by default. These import the
+    calling script again, so a script using ``n_jobs > 1`` has to guard its
+    code with ``if __name__ == '__main__':``, otherwise the pool cannot
+    start its workers and the call hangs.
+
+    Examples
+    --------
+    >>> if __name__ == '__main__':
+    ...     funcs = ['run%s.nii.gz' % i for i in range(1, 9)]
+    ...     ts = load_mri_many(funcs, mask='V1_mask.nii.gz', n_jobs=4)
+    """
+    import multiprocessing
+
+    m = _load_mask(mask)
+
+    # run lengths and data types from the headers only
+    proxies = [_load_func(func) for func in funcs]
+    n_tps = [_n_tps(d) for d in proxies]
+    starts = np.concatenate([[0], np.cumsum(n_tps)])
+    dtype = np.result_type(*[_dtype(d) for d in proxies])
+    del proxies
+
+    shape = (m.n_voxel, int(starts[-1]))
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError('out has shape %s, expected %s' % (out.shape, shape))
+
+    if n_jobs == -1:
+        n_jobs = multiprocessing.cpu_count()
+    file_backed = isinstance(out, np.memmap) and out.filename is not None
+    direct = file_backed and out.flags.c_contiguous and n_jobs > 1
+    if direct:
+        out.flush()
+        tasks = [(i, func, chunk_tps,
+                  (out.filename, out.dtype, shape, out.offset, starts[i]))
+                 for i, func in enumerate(funcs)]
+    else:
+        tasks = [(i, func, chunk_tps, None) for i, func in enumerate(funcs)]
+
+    if n_jobs > 1:
+        # forking a process that runs threaded (numba/BLAS) code can
+        # deadlock, start fresh interpreters instead
+        if mp_context is None and hasattr(multiprocessing, 'get_context'):
+            mp_context = 'spawn'
+        if isinstance(mp_context, str):
+            mp_context = multiprocessing.get_context(mp_context)
+        if mp_context is not None:
+            multiprocessing = mp_context
+        pool = multiprocessing.Pool(n_jobs, _init_worker, (m, ))
+        try:
+            results = pool.imap_unordered(_load_run, tasks)
+            for i, ts in results:
+                if ts is not None:
+                    out[:, starts[i]:starts[i + 1]] = ts
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for i, func in enumerate(funcs):
+            t = starts[i]
+            for ts in _iter_masked(func, m, chunk_tps):
+                out[:, t:t + ts.shape[1]] = ts
+                t += ts.shape[1]
+
+    return out
+
+
+def _disk_dtype(data):
+    """smallest nifti-friendly type that holds ``data`` exactly"""
+    if data.dtype == bool:
+        return np.dtype(np.uint8)
+    if data.dtype.kind in 'iu' and data.dtype.itemsize == 8:
+        info = np.iinfo(np.int32)
+        lo, hi = (data.min(), data.max()) if data.size else (0, 0)
+        if lo >= info.min and hi <= info.max:
+            return np.dtype(np.int32)
+        return np.dtype(np.float64)
+    return data.dtype
+
+
+def save_mri(data, mask, fname=None, dtype=None, compresslevel=1):
     """save MRI voxel data
 
+    The image is written volume by volume, so only a single volume is held
+    in memory besides ``data``. Filenames ending in ``.gz`` are compressed
+    on the fly. Other extensions than ``.nii`` and ``.nii.gz`` are written
+    by nibabel.
+
     Parameters
     ----------
     data : ndarray, shape(n_voxel,) **or** shape(n_voxel, n_tps)
        Voxel data to save to disk.
-    mask : string
+    mask : string | Mask
         Path to binary mask (e.g. nifti) that defines brain regions. Values > 0
-        are regarded as brain tissue.
-    fname : string
-        Filename.
+        are regarded as brain tissue. Pass a ``Mask`` to reuse it.
+    fname : string | path | None
+        Filename (default=None). If None, the image is returned instead.
+    dtype : dtype | None
+        Data type on disk (default=None, i.e. the type of ``data``; booleans
+        are saved as uint8, 64-bit integers as int32 or float64 if they do
+        not fit). Values are cast without scaling.
+    compresslevel : int
+        gzip compression level for ``.gz`` files (default=1).
+
+    Returns
+    -------
+    img : Nifti1Image | None
+        In-memory image, only if ``fname`` is None.
 
     Examples
     --------
     >>> ts = load_mri(func='localizer.nii.gz', mask='V1_mask.nii.gz')
     >>> ts = ts + 1. # some operation
     >>> save_mri(ts, 'V1_mask.nii.gz', 'localizer_plus_one.nii.gz')
+    >>> save_mri(ts, 'V1_mask.nii.gz', 'localizer.nii.gz', dtype=np.float32)
     """
+    import gzip
+    import nibabel as nib
+
     # load mask data
-    f = nib.load(mask)
-    m = f.get_data()
-    aff = f.get_affine()
+    with stage('save_mri.mask') as st:
+        m = _load_mask(mask)
+        st.record(indices=m.indices)
+
+    data = np.asanyarray(data)
+    if dtype is None:
+        dtype = _disk_dtype(data)
 
     s = m.shape
     if len(data.shape) == 2:
@@ -79,10 +422,45 @@ def save_mri(data, mask, fname=None):
     else:
         n_tps = 1
         data = data[:, np.newaxis]
+    shape = (s[0], s[1], s[2], n_tps)  # + time
 
-    res = np.zeros((s[0], s[1], s[2], n_tps))  # + time
-    res[m != 0] = data
+    # an explicit header type, nibabel refuses 64-bit integers otherwise
+    hdr = nib.Nifti1Header()
+    hdr.set_data_dtype(dtype)
 
-    # save to disk
     if fname is not None:
-        nib.save(nib.Nifti1Image(res, aff), fname)
+        fname = getattr(os, 'fspath', str)(fname)
+    if fname is None or not fname.endswith(('.nii', '.nii.gz')):
+        res = np.zeros(shape, dtype=dtype)
+        res.reshape(-1, n_tps)[m.indices] = data
+        img = nib.Nifti1Image(res, m.affine, hdr)
+        if fname is None:
+            return img
+        # other formats (e.g. analyze-style .img/.hdr pairs)
+        nib.save(img, fname)
+        return
+
+    # header of an image without data, broadcasting allocates no memory
+    img = nib.Nifti1Image(np.broadcast_to(np.zeros((), dtype), shape),
+                          m.affine, hdr)
+    hdr = img.header
+    disk_dtype = hdr.get_data_dtype()
+
+    with stage('save_mri.write') as st:
+        if fname.endswith('.gz'):
+            f = gzip.open(fname, 'wb', compresslevel=compresslevel)
+        else:
+            f = open(fname, 'wb')
+        try:
+            hdr.write_to(f)
+            f.write(b'\x00' * (int(hdr.get_data_offset()) - f.tell()))
+
+            # nifti stores volumes in Fortran order, one after the other
+            vol = np.zeros(s, dtype=disk_dtype)
+            flat = vol.reshape(-1)
+            for t in range(n_tps):
+                flat[m.indices] = data[:, t]
+                f.write(vol.tobytes(order='F'))
+        finally:
+            f.close()
+        st.record(volume=vol)
@@ -0,0 +1,495 @@
+import numpy as np
+from .grid import _resolve_grid
+from .prf import _prf_arrays
+
+__all__ = ["SeparableRFMatrix", "AnalyticRFMatrix", "PointRFMatrix"]
+
+
+def _gaussian_profiles(x0, y0, s0, xv, yv, dtype=np.float64):
+    """1D gaussian profiles along x and y, one row per voxel
+
+    An isotropic gaussian factorizes into
+    exp(-(x-x0)**2 / 2s0**2) * exp(-(y-y0)**2 / 2s0**2), hence the full
+    receptive field of voxel ``i`` is ``np.outer(gy[i], gx[i])``. All
+    arithmetic is done in ``dtype``.
+    """
+    x0 = np.atleast_1d(np.asarray(x0, dtype=dtype))
+    y0 = np.atleast_1d(np.asarray(y0, dtype=dtype))
+    s_factor2 = 2 * np.atleast_1d(np.asarray(s0, dtype=dtype))**2
+    xv = np.asarray(xv, dtype=dtype)
+    yv = np.asarray(yv, dtype=dtype)
+
+    dx2 = (xv[np.newaxis, :] - x0[:, np.newaxis])**2
+    dy2 = (yv[np.newaxis, :] - y0[:, np.newaxis])**2
+    gx = np.exp(-dx2 / s_factor2[:, np.newaxis])
+    gy = np.exp(-dy2 / s_factor2[:, np.newaxis])
+    return gx, gy
+
+
+class SeparableRFMatrix(object):
+    """Receptive field design matrix in separable (outer-product) form
+
+    Represents the (n_voxel, n_pixel) matrix whose rows are the raveled
+    gaussian receptive fields of all voxels, without materializing it. Only
+    the 1D profiles along x and y are stored, i.e. memory is
+    O(n_voxel * (xdim + ydim)) instead of O(n_voxel * xdim * ydim).
+
+    Parameters
+    ----------
+    x0 : array, shape(n_voxel, ) | PRFSet
+         Centers of gaussian in visual degrees, or a ``PRFSet`` holding all
+         pRF parameters (``y0`` and ``s0`` are omitted then).
+    y0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    s0 : array, shape(n_voxel, )
+         Sizes/sigmas of gaussian in visual degrees.
+    extent : scalars (left, right, bottom, top), default: [-8, 8, -8, 8]
+         Screen dimensions in visual degrees.
+    resolution : float
+         Interpolation steps in visual degrees (default=0.5).
+    grid : VisualFieldGrid | None
+         Grid to use instead of ``extent`` and ``resolution``
+         (default=None).
+    dtype : dtype
+         Floating point type of the profiles and of all products
+         (default=np.float64). ``np.float32`` halves memory and bandwidth.
+    block_size : int
+         Maximum number of entries of the temporaries of products with
+         many targets, which are computed in blocks of voxels
+         (default=2**22).
+
+    Attributes
+    ----------
+    gx : array, shape(n_voxel, xdim)
+        Receptive field profiles along x.
+    gy : array, shape(n_voxel, ydim)
+        Receptive field profiles along y (top row first).
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> X = SeparableRFMatrix(x0, y0, s0)
+    >>> S = X.rmatvec(betas).reshape(X.image_shape)
+    """
+
+    def __init__(self, x0, y0=None, s0=None, extent=[-8, 8, -8, 8],
+                 resolution=0.5, grid=None, dtype=np.float64,
+                 block_size=2**22):
+        x0, y0, s0 = _prf_arrays(x0, y0, s0)
+        self.grid = _resolve_grid(grid, extent, resolution)
+        self.gx, self.gy = _gaussian_profiles(x0, y0, s0, self.xv, self.yv,
+                                              dtype)
+        self.block_size = block_size
+
+    @classmethod
+    def from_profiles(cls, gx, gy, grid, block_size=2**22):
+        """build from precomputed profiles on ``grid``"""
+        X = cls.__new__(cls)
+        X.gx, X.gy, X.grid = gx, gy, grid
+        X.block_size = block_size
+        return X
+
+    @property
+    def xv(self):
+        return self.grid.xv
+
+    @property
+    def yv(self):
+        return self.grid.yv
+
+    @property
+    def n_voxel(self):
+        return self.gx.shape[0]
+
+    @property
+    def image_shape(self):
+        return (self.yv.shape[0], self.xv.shape[0])
+
+    @property
+    def shape(self):
+        ydim, xdim = self.image_shape
+        return (self.n_voxel, ydim * xdim)
+
+    @property
+    def dtype(self):
+        return self.gx.dtype
+
+    def matvec(self, w):
+        """Project pixel values onto the receptive fields (``X @ w``)
+
+        Parameters
+        ----------
+        w : array, shape(n_pixel, ) **or** shape(n_pixel, n_targets)
+            Pixel values, raveled in image order.
+
+        Returns
+        -------
+        b : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+        """
+        w = np.asarray(w, dtype=self.dtype)
+        ydim, xdim = self.image_shape
+        if w.ndim == 1:
+            return (np.dot(self.gy, w.reshape(ydim, xdim)) * self.gx).sum(1)
+
+        n_targets = w.shape[1]
+        b = np.empty((self.n_voxel, n_targets), dtype=self.dtype)
+        dense, chunk_size = self._chunk_size(n_targets)
+        W = w.reshape(ydim, xdim * n_targets)
+        for start in range(0, self.n_voxel, chunk_size):
+            rows = slice(start, start + chunk_size)
+            if dense:
+                b[rows] = np.dot(self.todense(rows.start, rows.stop), w)
+            else:
+                tmp = np.dot(self.gy[rows], W).reshape(-1, xdim, n_targets)
+                b[rows] = np.einsum('vjk,vj->vk', tmp, self.gx[rows])
+        return b
+
+    def rmatvec(self, b):
+        """Weighted sum of receptive fields (``X.T @ b``)
+
+        Parameters
+        ----------
+        b : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+            Voxel weights.
+
+        Returns
+        -------
+        w : array, shape(n_pixel, ) **or** shape(n_pixel, n_targets)
+            Raveled images.
+        """
+        b = np.asarray(b, dtype=self.dtype)
+        ydim, xdim = self.image_shape
+        if b.ndim == 1:
+            return np.dot(self.gy.T * b, self.gx).ravel()
+
+        n_targets = b.shape[1]
+        w = np.zeros((ydim * xdim, n_targets), dtype=self.dtype)
+        dense, chunk_size = self._chunk_size(n_targets)
+        for start in range(0, self.n_voxel, chunk_size):
+            rows = slice(start, start + chunk_size)
+            if dense:
+                X = self.todense(rows.start, rows.stop)
+                w += np.dot(X.T, b[rows])
+                continue
+            tmp = self.gy[rows, :, np.newaxis] * b[rows, np.newaxis, :]
+            tmp = np.dot(tmp.reshape(-1, ydim * n_targets).T, self.gx[rows])
+            w.reshape(ydim, xdim, n_targets)[:] += tmp.reshape(
+                ydim, n_targets, xdim).transpose(0, 2, 1)
+        return w
+
+    def _chunk_size(self, n_targets):
+        """voxel rows per block of a product with ``n_targets`` columns
+
+        The separable product needs n_targets * max(xdim, ydim) entries per
+        voxel, for many targets dense blocks of the design matrix are
+        smaller (and faster). Blocks hold at most ``block_size`` entries.
+        """
+        ydim, xdim = self.image_shape
+        dense = n_targets > min(xdim, ydim)
+        per_voxel = ydim * xdim if dense else max(xdim, ydim) * n_targets
+        return dense, max(1, self.block_size // per_voxel)
+
+    def gram(self):
+        """Voxel by voxel inner products of the receptive fields (X @ X.T)
+
+        Computed from the 1D profiles as (gy @ gy.T) * (gx @ gx.T).
+        """
+        return np.dot(self.gy, self.gy.T) * np.dot(self.gx, self.gx.T)
+
+    def todense(self, start=0, stop=None):
+        """Materialize the design matrix, shape(n_voxel, n_pixel)
+
+        ``start`` and ``stop`` restrict the result to a block of voxel rows.
+        """
+        gx = self.gx[start:stop]
+        gy = self.gy[start:stop]
+        X = gy[:, :, np.newaxis] * gx[:, np.newaxis, :]
+        return X.reshape(gx.shape[0], self.shape[1])
+
+    def tosparse(self, truncate=3.):
+        """sparse design matrix of receptive fields truncated at truncate * s0
+
+        Only the pixels inside the bounding box of each receptive field, i.e.
+        within ``truncate`` sigmas of its center along x and y, are stored.
+
+        Parameters
+        ----------
+        truncate : float
+            Truncation radius in multiples of s0 (default=3.).
+
+        Returns
+        -------
+        X : scipy.sparse.csr_matrix, shape(n_voxel, n_pixel)
+        """
+        from scipy import sparse
+
+        # the profiles are unimodal, hence entries above the value at
+        # truncate * s0 form one contiguous interval per voxel
+        threshold = np.exp(-truncate**2 / 2.)
+        inside_x = self.gx >= threshold
+        inside_y = self.gy >= threshold
+        nx, ny = inside_x.sum(1), inside_y.sum(1)
+        jx, iy = np.argmax(inside_x, 1), np.argmax(inside_y, 1)
+
+        nnz = nx * ny
+        indptr = np.concatenate([[0], np.cumsum(nnz)])
+        rows = np.repeat(np.arange(self.n_voxel), nnz)
+        local = np.arange(indptr[-1]) - indptr[rows]
+        i = iy[rows] + local // np.maximum(nx[rows], 1)
+        j = jx[rows] + local % np.maximum(nx[rows], 1)
+
+        data = self.gy[rows, i] * self.gx[rows, j]
+        indices = i * self.xv.shape[0] + j
+        return sparse.csr_matrix((data, indices, indptr), shape=self.shape)
+
+    def iter_dense(self, chunk_size):
+        """Iterate over dense blocks of at most ``chunk_size`` voxel rows
+
+        Yields
+        ------
+        rows : slice
+            Voxel rows covered by the block.
+        X : array, shape(n_rows, n_pixel)
+            Dense design matrix block.
+        """
+        for start in range(0, self.n_voxel, chunk_size):
+            stop = min(start + chunk_size, self.n_voxel)
+            yield slice(start, stop), self.todense(start, stop)
+
+
+def _gaussian_overlaps(c, s, lower=None, upper=None):
+    """integrals of all pairwise products of 1D gaussians, shape(n, n)
+
+    The product of two gaussians is a scaled gaussian with variance
+    s1**2 * s2**2 / (s1**2 + s2**2), hence its integral over the real line
+    (or, with ``lower`` and ``upper``, over a finite interval) is closed form.
+    """
+    s2 = s**2
+    var_sum = s2[:, np.newaxis] + s2[np.newaxis, :]
+    var = np.outer(s2, s2) / var_sum
+    K = np.sqrt(2 * np.pi * var) * np.exp(
+        -(c[:, np.newaxis] - c[np.newaxis, :])**2 / (2 * var_sum))
+
+    if lower is not None:
+        from scipy.special import erf
+
+        weighted = c[:, np.newaxis] * s2[np.newaxis, :]
+        mean = (weighted + weighted.T) / var_sum
+        scale = np.sqrt(2 * var)
+        K *= (erf((upper - mean) / scale) - erf((lower - mean) / scale)) / 2
+    return K
+
+
+class AnalyticRFMatrix(SeparableRFMatrix):
+    """Receptive field design matrix with a closed-form Gram matrix
+
+    Inner products of gaussian receptive fields are integrals of products of
+    gaussians, which are known analytically. ``gram`` therefore costs
+    O(n_voxel**2) independent of the resolution, and the dual (voxel space)
+    ridge solution only touches pixels when the image is rendered. The
+    analytic Gram matrix matches the pixel sums as long as receptive fields
+    are wider than the pixel spacing.
+
+    Parameters
+    ----------
+    x0 : array, shape(n_voxel, ) | PRFSet
+         Centers of gaussian in visual degrees, or a ``PRFSet`` holding all
+         pRF parameters (``y0`` and ``s0`` are omitted then).
+    y0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    s0 : array, shape(n_voxel, )
+         Sizes/sigmas of gaussian in visual degrees.
+    extent : scalars (left, right, bottom, top), default: [-8, 8, -8, 8]
+         Screen dimensions in visual degrees.
+    resolution : float
+         Interpolation steps in visual degrees (default=0.5).
+    grid : VisualFieldGrid | None
+         Grid to use instead of ``extent`` and ``resolution``
+         (default=None).
+    dtype : dtype
+         Floating point type of the profiles and of all products
+         (default=np.float64).
+    finite_screen : bool
+         Integrate over the screen only instead of the whole plane, which
+         accounts for receptive fields that are cut off at the screen border
+         (default=True).
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> X = AnalyticRFMatrix(x0, y0, s0, resolution=0.05)
+    >>> clf = RidgeGCV(mode='dual').fit(X, betas)
+    """
+
+    def __init__(self, x0, y0=None, s0=None, extent=[-8, 8, -8, 8],
+                 resolution=0.5, grid=None, dtype=np.float64,
+                 finite_screen=True):
+        x0, y0, s0 = _prf_arrays(x0, y0, s0)
+        SeparableRFMatrix.__init__(self, x0, y0, s0, extent, resolution,
+                                   grid, dtype)
+        self._set_prf(x0, y0, s0, finite_screen)
+
+    @classmethod
+    def from_profiles(cls, gx, gy, grid, x0, y0, s0, finite_screen=True):
+        """build from precomputed profiles of the pRFs ``x0, y0, s0``"""
+        X = super(AnalyticRFMatrix, cls).from_profiles(gx, gy, grid)
+        X._set_prf(x0, y0, s0, finite_screen)
+        return X
+
+    def _set_prf(self, x0, y0, s0, finite_screen):
+        self.x0, self.y0, self.s0 = [np.atleast_1d(np.asarray(
+            p, dtype=self.dtype)) for p in (x0, y0, s0)]
+        self.finite_screen = finite_screen
+
+    def gram(self):
+        """Voxel by voxel inner products of the receptive fields (X @ X.T)
+
+        The integrals of the receptive field products divided by the pixel
+        area, i.e. the limit of the pixel sums for fine resolutions.
+        """
+        res = self.grid.resolution
+        bounds = [(None, None), (None, None)]
+        if self.finite_screen:
+            # pixels cover half a step beyond the outermost pixel centers
+            bounds = [(v.min() - res / 2, v.max() + res / 2)
+                      for v in (self.xv, self.yv)]
+        Kx = _gaussian_overlaps(self.x0, self.s0, *bounds[0])
+        Ky = _gaussian_overlaps(self.y0, self.s0, *bounds[1])
+        return (Kx * Ky / res**2).astype(self.dtype, copy=False)
+
+
+def _point_rfs(x0, y0, s0, x, y, dtype=np.float64):
+    """receptive fields at the points (x, y), shape(n_voxel, n_points)"""
+    x0, y0, s0 = [np.atleast_1d(np.asarray(p, dtype=dtype))[:, np.newaxis]
+                  for p in (x0, y0, s0)]
+    x = np.asarray(x, dtype=dtype)
+    y = np.asarray(y, dtype=dtype)
+    return np.exp(-((x - x0)**2 + (y - y0)**2) / (2 * s0**2))
+
+
+class PointRFMatrix(object):
+    """Receptive field design matrix on an arbitrary set of points
+
+    Receptive fields do not factorize on nonuniform grids, so products are
+    computed from dense blocks of at most ``block_size`` entries that are
+    generated on the fly. The interface matches ``SeparableRFMatrix``.
+
+    Parameters
+    ----------
+    x0 : array, shape(n_voxel, ) | PRFSet
+         Centers of gaussian in visual degrees, or a ``PRFSet`` holding all
+         pRF parameters (``y0`` and ``s0`` are omitted then).
+    y0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    s0 : array, shape(n_voxel, )
+         Sizes/sigmas of gaussian in visual degrees.
+    grid : PointGrid
+         Points to evaluate the receptive fields at (required).
+    dtype : dtype
+         Floating point type of all products (default=np.float64).
+    block_size : int
+         Maximum number of design matrix entries held in memory
+         (default=2**22).
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> X = PointRFMatrix(x0, y0, s0, log_polar_grid())
+    >>> S = X.rmatvec(betas)
+    """
+
+    def __init__(self, x0, y0=None, s0=None, grid=None, dtype=np.float64,
+                 block_size=2**22):
+        if grid is None:
+            raise TypeError('PointRFMatrix requires a grid')
+        self.x0, self.y0, self.s0 = [np.atleast_1d(np.asarray(
+            p, dtype=dtype)) for p in _prf_arrays(x0, y0, s0)]
+        self.grid = grid
+        self.block_size = block_size
+
+    @property
+    def n_voxel(self):
+        return self.x0.shape[0]
+
+    @property
+    def image_shape(self):
+        return self.grid.shape
+
+    @property
+    def shape(self):
+        return (self.n_voxel, self.grid.size)
+
+    @property
+    def dtype(self):
+        return self.x0.dtype
+
+    def _chunk_size(self, n):
+        return max(1, self.block_size // max(n, 1))
+
+    def todense(self, start=0, stop=None):
+        """Materialize the design matrix, shape(n_voxel, n_points)
+
+        ``start`` and ``stop`` restrict the result to a block of voxel rows.
+        """
+        rows = slice(start, stop)
+        return _point_rfs(self.x0[rows], self.y0[rows], self.s0[rows],
+                          self.grid.x, self.grid.y, self.dtype)
+
+    def iter_dense(self, chunk_size):
+        """Iterate over dense blocks of at most ``chunk_size`` voxel rows"""
+        for start in range(0, self.n_voxel, chunk_size):
+            stop = min(start + chunk_size, self.n_voxel)
+            yield slice(start, stop), self.todense(start, stop)
+
+    def _iter_columns(self):
+        """dense blocks of point columns for all voxels"""
+        chunk_size = self._chunk_size(self.n_voxel)
+        for start in range(0, self.grid.size, chunk_size):
+            cols = slice(start, start + chunk_size)
+            yield cols, _point_rfs(self.x0, self.y0, self.s0,
+                                   self.grid.x[cols], self.grid.y[cols],
+                                   self.dtype)
+
+    def matvec(self, w):
+        """Project point values onto the receptive fields (``X @ w``)"""
+        w = np.asarray(w, dtype=self.dtype)
+        b = np.zeros((self.n_voxel, ) + w.shape[1:], dtype=self.dtype)
+        for cols, X in self._iter_columns():
+            b += np.dot(X, w[cols])
+        return b
+
+    def rmatvec(self, b):
+        """Weighted sum of receptive fields (``X.T @ b``)"""
+        b = np.asarray(b, dtype=self.dtype)
+        w = np.empty((self.grid.size, ) + b.shape[1:], dtype=self.dtype)
+        for cols, X in self._iter_columns():
+            w[cols] = np.dot(X.T, b)
+        return w
+
+    def gram(self):
+        """Voxel by voxel inner products of the receptive fields (X @ X.T)"""
+        K = np.zeros((self.n_voxel, self.n_voxel), dtype=self.dtype)
+        for cols, X in self._iter_columns():
+            K += np.dot(X, X.T)
+        return K
+
+    def tosparse(self, truncate=3.):
+        """sparse design matrix of receptive fields truncated at truncate * s0
+
+        Points further than ``truncate`` sigmas from the center along x or y
+        are dropped, as in ``SeparableRFMatrix.tosparse``.
+
+        Returns
+        -------
+        X : scipy.sparse.csr_matrix, shape(n_voxel, n_points)
+        """
+        from scipy import sparse
+
+        blocks = []
+        for rows, X in self.iter_dense(self._chunk_size(self.grid.size)):
+            radius = truncate * np.abs(self.s0[rows, np.newaxis])
+            dx = np.abs(self.grid.x - self.x0[rows, np.newaxis])
+            dy = np.abs(self.grid.y - self.y0[rows, np.newaxis])
+            X[(dx > radius) | (dy > radius)] = 0
+            blocks.append(sparse.csr_matrix(X))
+        return sparse.vstack(blocks, format='csr')
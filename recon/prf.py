@@ -0,0 +1,148 @@
+import numbers
+import numpy as np
+
+__all__ = ["PRFSet"]
+
+
+class PRFSet(object):
+    """pRF parameters of many voxels in a single contiguous array
+
+    The fields ``x0``, ``y0``, ``s0`` and ``r2`` are the rows of one
+    (4, n_voxel) array, so every field is a contiguous view and the whole set
+    is saved, loaded and memory-mapped as a single array. A ``PRFSet`` can be
+    passed wherever ``x0, y0, s0`` are accepted.
+
+    Parameters
+    ----------
+    x0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    y0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    s0 : array, shape(n_voxel, )
+         Sizes/sigmas of gaussian in visual degrees.
+    r2 : array, shape(n_voxel, ) | None
+         Explained variance of pRF-model per voxel (default=None, stored as
+         NaN).
+    dtype : dtype
+         Floating point type of the parameters (default=np.float64).
+
+    Attributes
+    ----------
+    data : array, shape(4, n_voxel)
+        Parameters, one field per row.
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> prfs = PRFSet(x0, y0, s0, r2)
+    >>> idx = prfs.select(r2_thr=0., s0_thr=2.5)
+    >>> S = stimulus_reconstruction(prfs[idx], betas[idx])
+    >>> prfs.save('prfs.npy')
+    >>> prfs = PRFSet.load('prfs.npy')  # memory-mapped
+    """
+
+    __slots__ = ('data', )
+
+    fields = ('x0', 'y0', 's0', 'r2')
+
+    def __init__(self, x0, y0, s0, r2=None, dtype=np.float64):
+        n_voxel = np.size(x0)
+        self.data = np.empty((len(self.fields), n_voxel), dtype=dtype)
+        for i, values in enumerate((x0, y0, s0,
+                                    np.nan if r2 is None else r2)):
+            self.data[i] = values
+
+    @classmethod
+    def from_array(cls, data):
+        """wrap a (4, n_voxel) array (e.g. a memmap) without copying"""
+        if np.ndim(data) != 2 or np.shape(data)[0] != len(cls.fields):
+            raise ValueError('data must have shape (%s, n_voxel), got %s'
+                             % (len(cls.fields), np.shape(data)))
+        prfs = cls.__new__(cls)
+        prfs.data = data
+        return prfs
+
+    @property
+    def x0(self):
+        return self.data[0]
+
+    @property
+    def y0(self):
+        return self.data[1]
+
+    @property
+    def s0(self):
+        return self.data[2]
+
+    @property
+    def r2(self):
+        return self.data[3]
+
+    @property
+    def n_voxel(self):
+        return self.data.shape[1]
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __repr__(self):
+        return 'PRFSet(n_voxel=%s, dtype=%s)' % (self.n_voxel,
+                                                 self.data.dtype)
+
+    def __getitem__(self, key):
+        """subset of voxels
+
+        Slices and integers (a set of one voxel) return views, boolean masks
+        and index arrays a compact copy.
+        """
+        if isinstance(key, numbers.Integral) and not isinstance(key, bool):
+            key = slice(key, key + 1 or None)
+        return PRFSet.from_array(self.data[:, key])
+
+    def astuple(self):
+        """views ``(x0, y0, s0, r2)``"""
+        return tuple(self.data)
+
+    def select(self, r2_thr=5., s0_thr=2.5, extent=[-8, 8, -8, 8]):
+        """indices of voxels passing the criteria of ``select_prf``
+
+        Voxels without an r2 (NaN) pass the r2 criterion. Only the index set
+        is computed, index the ``PRFSet`` (or betas) with it when needed.
+        """
+        r2 = np.where(np.isnan(self.r2), np.inf, self.r2)
+        return _prf_selection(self.x0, self.y0, self.s0, r2, r2_thr, s0_thr,
+                              extent)
+
+    def save(self, fname):
+        """save to ``.npy`` (memory-mappable) or compressed ``.npz``"""
+        if str(fname).endswith('.npz'):
+            np.savez_compressed(fname, prf=self.data)
+        else:
+            np.save(fname, self.data)
+
+    @classmethod
+    def load(cls, fname, mmap_mode='r'):
+        """load a saved set, ``.npy`` files are memory-mapped by default"""
+        data = np.load(fname, mmap_mode=mmap_mode)
+        if hasattr(data, 'files'):
+            with data:
+                data = data['prf']
+        return cls.from_array(data)
+
+
+def _prf_selection(x0, y0, s0, r2, r2_thr, s0_thr, extent):
+    """indices of voxels with valid pRFs inside the extent"""
+    xmin, xmax, ymin, ymax = extent
+    # NB, in rare cases s0 can be estimated as nonsensical 0
+    inside = (y0 >= ymin) & (y0 <= ymax) & (x0 >= xmin) & (x0 <= xmax)
+    selection = (r2 >= r2_thr) & (s0 <= s0_thr) & (s0 != 0) & inside
+    return np.flatnonzero(selection)
+
+
+def _prf_arrays(x0, y0, s0):
+    """``x0, y0, s0`` from loose arrays or a ``PRFSet`` passed as ``x0``"""
+    if isinstance(x0, PRFSet):
+        return x0.x0, x0.y0, x0.s0
+    if y0 is None or s0 is None:
+        raise TypeError('y0 and s0 are required unless x0 is a PRFSet')
+    return x0, y0, s0
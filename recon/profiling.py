@@ -0,0 +1,174 @@
+import time
+from contextlib import contextmanager
+
+__all__ = ["set_profiler", "Profile"]
+
+_profiler = None
+
+
+def set_profiler(callback):
+    """install a callback receiving per-stage profiling records
+
+    Every instrumented stage (grid and RF construction, ridge decomposition
+    and solve, MRI reading and writing) calls ``callback(record)`` when it
+    finishes. ``record`` is a dict with the keys
+
+    - ``stage``: name of the stage, e.g. ``'reconstruction.rf_basis'``
+    - ``time``: wall time in seconds
+    - ``memory``: net bytes allocated (only if ``tracemalloc`` is tracing)
+    - ``peak_memory``: peak bytes allocated (only if ``tracemalloc`` is
+      tracing)
+    - ``shapes``: shapes of the arrays the stage produced
+    - ``nbytes``: total size of these arrays in bytes
+
+    Parameters
+    ----------
+    callback : callable | None
+        Profiling callback, None disables profiling (default).
+
+    Returns
+    -------
+    previous : callable | None
+        The previously installed callback.
+
+    Examples
+    --------
+    >>> set_profiler(print)
+    >>> S = stimulus_reconstruction(x0, y0, s0, betas)
+    >>> set_profiler(None)
+    """
+    global _profiler
+    previous = _profiler
+    _profiler = callback
+    return previous
+
+
+class _Stage(object):
+    __slots__ = ('shapes', 'nbytes')
+
+    def __init__(self):
+        self.shapes = {}
+        self.nbytes = 0
+
+    def record(self, **arrays):
+        """register arrays produced by the stage"""
+        for name, array in arrays.items():
+            self.shapes[name] = tuple(getattr(array, 'shape', ()))
+            self.nbytes += int(getattr(array, 'nbytes', 0))
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def record(self, **arrays):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+@contextmanager
+def stage(name):
+    """time a stage and report it to the installed profiler"""
+    profiler = _profiler
+    if profiler is None:
+        yield _null_stage
+        return
+
+    import tracemalloc
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    st = _Stage()
+    t0 = time.time()
+    yield st
+    record = {'stage': name, 'time': time.time() - t0,
+              'memory': None, 'peak_memory': None,
+              'shapes': st.shapes, 'nbytes': st.nbytes}
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        record['memory'] = current - start_memory
+        record['peak_memory'] = peak - start_memory
+    profiler(record)
+
+
+class Profile(object):
+    """collect profiling records of all stages run inside a ``with`` block
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Track allocations with ``tracemalloc`` (default=False). This slows
+        down execution.
+
+    Attributes
+    ----------
+    records : list of dicts
+        One record per stage, see ``set_profiler``.
+
+    Examples
+    --------
+    >>> with Profile(trace_memory=True) as prof:
+    ...     ts = load_mri('localizer.nii.gz', 'V1_mask.nii.gz')
+    ...     S = stimulus_reconstruction(x0, y0, s0, ts[idx])
+    >>> print(prof.report())
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def __enter__(self):
+        self._started_tracing = False
+        if self.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        self._previous = set_profiler(self)
+        return self
+
+    def __exit__(self, *exc):
+        set_profiler(self._previous)
+        if self._started_tracing:
+            import tracemalloc
+            tracemalloc.stop()
+
+    def summary(self):
+        """aggregate records per stage
+
+        Returns
+        -------
+        summary : dict
+            Maps stage names to dicts with ``calls``, total ``time``, total
+            ``nbytes`` and maximal ``peak_memory``.
+        """
+        summary = {}
+        for record in self.records:
+            s = summary.setdefault(record['stage'], {
+                'calls': 0, 'time': 0., 'nbytes': 0, 'peak_memory': None})
+            s['calls'] += 1
+            s['time'] += record['time']
+            s['nbytes'] += record['nbytes']
+            if record['peak_memory'] is not None:
+                s['peak_memory'] = max(s['peak_memory'] or 0,
+                                       record['peak_memory'])
+        return summary
+
+    def report(self):
+        """human readable table of ``summary``"""
+        lines = ['%-32s %6s %10s %12s %12s' % (
+            'stage', 'calls', 'time [s]', 'output [MB]', 'peak [MB]')]
+        for name, s in sorted(self.summary().items(),
+                              key=lambda item: -item[1]['time']):
+            peak = '-' if s['peak_memory'] is None else \
+                '%.2f' % (s['peak_memory'] / 2.**20)
+            lines.append('%-32s %6d %10.4f %12.2f %12s' % (
+                name, s['calls'], s['time'], s['nbytes'] / 2.**20, peak))
+        return '\n'.join(lines)
@@ -1,9 +1,14 @@
 import numpy as np
-from numba import jit
 from .due import due, Doi
+from .kernels import jit
+from .grid import VisualFieldGrid, _resolve_grid
+from .operators import _gaussian_profiles, _point_rfs
+from .prf import PRFSet, _prf_arrays, _prf_selection
+from .model import ReconstructionModel
 
 __all__ = ["select_prf", "gaussian_receptive_field", "stimulus_reconstruction",
-           "example_prf_data", "gaussian_receptive_field_faster"]
+           "example_prf_data", "gaussian_receptive_field_faster",
+           "gaussian_receptive_fields"]
 
 
 # Use duecredit (duecredit.org) to provide a citation to relevant work to
@@ -17,7 +22,8 @@ due.cite(Doi("10.1167/13.9.30"),
 
 def gaussian_receptive_field(x0=0., y0=0., s0=1., amplitude=1.,
                              extent=[-8, 8, -8, 8], resolution=0.5,
-                             norm=False, X=None, Y=None):
+                             norm=False, X=None, Y=None, grid=None,
+                             dtype=np.float64):
     """Gaussian 2D receptive field
 
     Parameters
@@ -36,6 +42,11 @@ def gaussian_receptive_field(x0=0., y0=0., s0=1., amplitude=1.,
          Interpolation steps in visual degrees (default=0.5).
     norm : bool
         Normalize gaussian to unit area under the curve (default=False).
+    grid : VisualFieldGrid | PointGrid | None
+        Grid to use instead of ``extent`` and ``resolution`` (default=None).
+        On a ``PointGrid`` the receptive field has shape(n_points, ).
+    dtype : dtype
+        Floating point type of the receptive field (default=np.float64).
 
     Examples
     --------
@@ -45,13 +56,15 @@ def gaussian_receptive_field(x0=0., y0=0., s0=1., amplitude=1.,
     """
 
     if X is None:
-        xmin, xmax, ymin, ymax = extent
-        xv = np.arange(xmin, xmax, resolution)
-        yv = np.arange(ymin, ymax, resolution)
-        [X, Y] = np.meshgrid(xv, yv)
-        Y = np.flipud(Y)
-
-    s_factor2 = 2. * s0**2
+        # broadcasting the (cached) coordinate vectors, no meshgrid needed
+        grid = _resolve_grid(grid, extent, resolution, points=True)
+        X, Y = grid.coordinates()
+    X = np.asarray(X, dtype=dtype)
+    Y = np.asarray(Y, dtype=dtype)
+    x0, y0, s0, amplitude = [np.asarray(p, dtype=dtype)
+                             for p in (x0, y0, s0, amplitude)]
+
+    s_factor2 = 2 * s0**2
     gauss = amplitude * np.exp(-((X-x0)**2 + (Y-y0)**2)/s_factor2)
 
     if norm:
@@ -60,7 +73,70 @@ def gaussian_receptive_field(x0=0., y0=0., s0=1., amplitude=1.,
     return gauss
 
 
-@jit(nopython=True)
+def gaussian_receptive_fields(x0, y0=None, s0=None, amplitude=1.,
+                              extent=[-8, 8, -8, 8], resolution=0.5,
+                              norm=False, grid=None, dtype=np.float64):
+    """Gaussian 2D receptive fields of many voxels at once
+
+    Vectorized version of ``gaussian_receptive_field``. The receptive fields
+    are built from separable 1D gaussians along x and y.
+
+    Parameters
+    ----------
+    x0 : array, shape(n_voxel, ) | PRFSet
+         Centers of gaussian in visual degrees, or a ``PRFSet`` holding all
+         pRF parameters (``y0`` and ``s0`` are omitted then).
+    y0 : array, shape(n_voxel, )
+         Centers of gaussian in visual degrees.
+    s0 : array, shape(n_voxel, )
+         Sizes/sigmas of gaussian in visual degrees.
+    amplitude : float | array, shape(n_voxel, )
+         Amplitude (default=1.)
+    extent : scalars (left, right, bottom, top), default: [-8, 8, -8, 8]
+         Screen dimensions in visual degrees.
+    resolution : float
+         Interpolation steps in visual degrees (default=0.5).
+    norm : bool
+        Normalize gaussians to unit area under the curve (default=False).
+    grid : VisualFieldGrid | PointGrid | None
+        Grid to use instead of ``extent`` and ``resolution`` (default=None).
+    dtype : dtype
+        Floating point type of the receptive fields (default=np.float64).
+
+    Returns
+    -------
+    G : array, shape(n_voxel, ydim, xdim) **or** shape(n_voxel, n_points)
+        Receptive field of each voxel.
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data(n_voxel=10)
+    >>> G = gaussian_receptive_fields(x0, y0, s0)
+    >>> G.shape
+    (10, 32, 32)
+    """
+    x0, y0, s0 = _prf_arrays(x0, y0, s0)
+    grid = _resolve_grid(grid, extent, resolution, points=True)
+    amplitude = np.broadcast_to(np.asarray(amplitude, dtype=dtype),
+                                (np.size(x0), ))
+
+    if not isinstance(grid, VisualFieldGrid):
+        G = _point_rfs(x0, y0, s0, grid.x, grid.y, dtype)
+        G *= amplitude[:, np.newaxis]
+        if norm:
+            G /= G.sum(1)[:, np.newaxis]
+        return G
+
+    gx, gy = _gaussian_profiles(x0, y0, s0, grid.xv, grid.yv, dtype)
+    gy = gy * amplitude[:, np.newaxis]
+
+    if norm:
+        gy /= (gy.sum(1) * gx.sum(1))[:, np.newaxis]
+
+    return gy[:, :, np.newaxis] * gx[:, np.newaxis, :]
+
+
+@jit(nopython=True, cache=True)
 def gaussian_receptive_field_faster(x0=0., y0=0., s0=1., amplitude=1.,
                                     extent=np.array([-8., 8., -8., 8.]),
                                     resolution=0.5):
@@ -110,7 +186,7 @@ def gaussian_receptive_field_faster(x0=0., y0=0., s0=1., amplitude=1.,
     # Y = np.flip((ZZ-XX),0) # not yet supported in numba 0.30.1
     Y = (ZZ-XX)[np.arange(YY.shape[0])[::-1], :]
 
-    return amplitude * np.exp(-((X-x0)**2 + (Y-y0)**2)/2. * s0**2)
+    return amplitude * np.exp(-((X-x0)**2 + (Y-y0)**2)/(2. * s0**2))
 
 
 def example_prf_data(n_voxel=100, dataset='noise', seed=42):
@@ -146,7 +222,7 @@ def example_prf_data(n_voxel=100, dataset='noise', seed=42):
 
     rng = np.random.RandomState(seed)
 
-    if dataset is not 'noise':
+    if dataset != 'noise':
         raise NotImplementedError('Selected dataset is not implemented')
     else:
         x0 = rng.normal(size=n_voxel)
@@ -162,14 +238,15 @@ def example_prf_data(n_voxel=100, dataset='noise', seed=42):
     return x0, y0, s0, r2, betas
 
 
-def select_prf(x0, y0, s0, r2=None, r2_thr=5., s0_thr=2.5,
+def select_prf(x0, y0=None, s0=None, r2=None, r2_thr=5., s0_thr=2.5,
                extent=[-8, 8, -8, 8], verbose=True):
     """select voxel based on prf-properties
 
     Parameters
     ----------
-    x0 : array, shape(n_voxel, )
-         Center of gaussian in visual degrees.
+    x0 : array, shape(n_voxel, ) | PRFSet
+         Center of gaussian in visual degrees, or a ``PRFSet`` holding all
+         pRF parameters (``y0``, ``s0`` and ``r2`` are omitted then).
     y0 : array, shape(n_voxel, )
          Center of gaussian in visual degrees.
     s0 : array, shape(n_voxel, )
@@ -200,30 +277,26 @@ def select_prf(x0, y0, s0, r2=None, r2_thr=5., s0_thr=2.5,
     idx : list
          Indices of selected voxels.
 
+    If ``x0`` is a ``PRFSet``, the selected ``PRFSet`` and ``idx`` are
+    returned.
+
     Examples
     --------
     >>> x0, y0, s0, r2, betas = example_prf_data()
     >>> x0, y0, s0, r2, idx = select_prf(x0, y0, s0, r2)
     """
 
-    n_voxel = x0.size
-    xmin, xmax, ymin, ymax = extent
+    if isinstance(x0, PRFSet):
+        idx = x0.select(r2_thr, s0_thr, extent)
+        if verbose:
+            print('Selected voxel: %s' % len(idx))
+        return x0[idx], idx
 
     # TODO assert that x0 shape == y0 shape etc
     if r2 is None:
-        r2 = np.ones(n_voxel) + r2_thr
-
-    selection = np.zeros(n_voxel)
-    selection[r2 >= r2_thr] += 1
-    selection[s0 <= s0_thr] += 1
-    selection[y0 >= ymin] += 1
-    selection[y0 <= ymax] += 1
-    selection[x0 >= xmin] += 1
-    selection[x0 <= xmax] += 1
+        r2 = np.ones(x0.size) + r2_thr
 
-    # NB, in rare cases s0 can be estimated as nonsensical 0
-    selection[s0 != 0] += 1
-    idx = np.where(selection == 7)[0]
+    idx = _prf_selection(x0, y0, s0, r2, r2_thr, s0_thr, extent)
 
     if verbose:
         print('Selected voxel: %s' % len(idx))
@@ -236,20 +309,27 @@ def select_prf(x0, y0, s0, r2=None, r2_thr=5., s0_thr=2.5,
     return x0, y0, s0, r2, idx
 
 
-def stimulus_reconstruction(x0, y0, s0, betas, method='summation',
-                            extent=[-8, 8, -8, 8], resolution=0.5, clf=None):
+def stimulus_reconstruction(x0, y0, s0=None, betas=None, method='summation',
+                            extent=[-8, 8, -8, 8], resolution=0.5, clf=None,
+                            alpha=None, chunk_size=None, max_memory=None,
+                            engine='blas', grid=None, truncate=None,
+                            solver='dense', tol=1e-6, dtype=np.float64,
+                            lazy=False):
     """prf-based stimulus reconstruction/inverse retinotopy
 
     Parameters
     ----------
-    x0 : array
-         Centers of gaussian in visual degrees.
+    x0 : array | PRFSet
+         Centers of gaussian in visual degrees, or a ``PRFSet`` holding all
+         pRF parameters. The betas are the second argument then, i.e.
+         ``stimulus_reconstruction(prfs, betas)``.
     y0 : array
          Centers of gaussian in visual degrees.
     s0 : array
          Sizes/sigmas of gaussian in visual degrees.
-    betas : array
-        Voxel activations.
+    betas : array, shape(n_voxel, ) **or** shape(n_voxel, n_tps)
+        Voxel activations. Multiple trials/timepoints are reconstructed
+        at once.
     method : string ['summation'|'multivariate']
         Reconstruction method to use (default='summation').
     extent : scalars (left, right, bottom, top), default: [-8, 8, -8, 8]
@@ -257,62 +337,94 @@ def stimulus_reconstruction(x0, y0, s0, betas, method='summation',
     resolution : float
          Interpolation steps in visual degrees (default=0.5).
     clf : class
-        Classifier for ``multivariate`` method (default=None).
+        Classifier for ``multivariate`` method (default=None). If None, a
+        ``RidgeGCV`` selects the regularization by generalized
+        cross-validation. Any estimator with ``fit`` and ``coef_`` can be
+        used, non-``RidgeGCV`` estimators receive the dense design matrix.
+    alpha : float | None
+        Fixed ridge regularization for the default ``multivariate`` solver
+        (default=None). Iterative solvers use 10. if None.
+    chunk_size : int | None
+        Build and consume the design matrix of the ``multivariate`` method in
+        blocks of ``chunk_size`` voxels (default=None).
+    max_memory : int | None
+        Memory budget in bytes for a design matrix block of the
+        ``multivariate`` method (default=None). Ignored if ``chunk_size`` is
+        given. Chunking requires a ``RidgeGCV`` classifier. The
+        (n_voxel, n_voxel) kernel that ``RidgeGCV`` decomposes when there
+        are fewer voxels than pixels is only used if its workspace (about
+        four kernels) fits the budget, otherwise the design matrix is
+        processed in blocks. The (n_pixel, n_pixel) Gram matrix and the
+        reconstructions are not covered by the budget.
+    engine : string ['blas'|'numba'|'fft']
+        Compute the ``summation`` method, and the dense design matrix of a
+        custom ``clf``, from separable profiles with matrix products
+        (``'blas'``) or with parallel numba kernels (``'numba'``, falls back
+        to ``'blas'`` without numba). The default ``multivariate`` solvers
+        always work on the separable profiles. ``'fft'`` computes the
+        ``summation`` method as a convolution of the betas with gaussians of
+        a few (16) quantized sizes, its cost scales with the number of
+        pixels instead of voxels times pixels and it requires positive
+        ``s0``. Default='blas'.
+    grid : VisualFieldGrid | PointGrid | None
+        Grid to use instead of ``extent`` and ``resolution`` (default=None).
+        Point grids, e.g. from ``log_polar_grid``, return images of
+        shape(n_points, ) and require the ``'blas'`` engine.
+    truncate : float | None
+        Truncate receptive fields at ``truncate * s0`` and work on a sparse
+        design matrix (default=None). Saves memory and time at fine
+        resolutions when receptive fields are small relative to the screen.
+    solver : string ['dense'|'analytic'|'lsqr'|'cg']
+        Solver of the default ``multivariate`` estimator (default='dense').
+        ``'dense'`` selects the regularization by generalized
+        cross-validation. ``'analytic'`` does the same in voxel space with
+        closed-form receptive field inner products, its cost is independent
+        of ``resolution`` until the final image is rendered. ``'lsqr'`` and
+        ``'cg'`` solve for a fixed ``alpha`` with matrix-free iterative
+        methods, which is faster for large grids.
+    tol : float
+        Tolerance of the iterative solvers (default=1e-6).
+    dtype : dtype
+        Floating point type of all computations (default=np.float64).
+        ``np.float32`` halves memory and bandwidth, which is plenty for noisy
+        fMRI activations.
+    lazy : bool
+        Return a ``Reconstruction`` holding the voxel weights, which
+        evaluates the image(s) on demand on any extent, resolution or set of
+        points (default=False).
 
     Returns
     -------
-    S : array, shape(n_pixel, n_pixel)
-         Reconstructed image. ``n_pixel``depends on ``resolution`` parameter.
+    S : array, shape(ydim, xdim) **or** shape(n_tps, ydim, xdim)
+         Reconstructed image(s). ``ydim`` and ``xdim`` depend on the
+         ``extent`` and ``resolution`` parameters. A ``Reconstruction`` if
+         ``lazy`` is True.
 
     Examples
     --------
     >>> x0, y0, s0, r2, betas = re.example_prf_data()
     >>> S = re.stimulus_reconstruction(x0, y0, s0, betas, method='summation')
-    """
-
-    n_voxel = x0.shape[0]
-
-    # TODO make sure x0 shape == y0 == s0
-    assert len(x0) == len(y0)
 
-    xmin, xmax, ymin, ymax = extent
-    xv = np.arange(xmin, xmax, resolution)
-    yv = np.arange(ymin, ymax, resolution)
-    [X, Y] = np.meshgrid(xv, yv)
-    Y = np.flipud(Y)
-
-    xdim = xv.shape[0]
-    ydim = yv.shape[0]
-
-    if method == 'summation':
-        S = np.zeros((xdim, ydim))
-        for i in range(n_voxel):
-            S += gaussian_receptive_field(x0[i], y0[i], s0[i], betas[i],
-                                          extent, resolution, X=X, Y=Y)
-
-        S /= n_voxel
+    spatio-temporal reconstruction of a whole run
 
-    elif method == 'multivariate':
-        from sklearn import linear_model
-
-        X = np.zeros((n_voxel, xdim * ydim))
-        for i in range(n_voxel):
-            X[i, :] = gaussian_receptive_field(x0[i], y0[i], s0[i]/1.,
-                                               amplitude=1, extent=extent,
-                                               resolution=resolution,
-                                               norm=False).ravel()
-
-        if clf is None:
-            alphas = [0, 10, 20, 30, 50, 100]
-            clf = linear_model.RidgeCV(alphas=alphas, cv=None,
-                                       fit_intercept=True, gcv_mode=None,
-                                       normalize=True, scoring=None,
-                                       store_cv_values=False)
-
-        clf.fit(X, betas)
-        S = clf.coef_.reshape(xdim, xdim)
+    >>> ts = np.random.normal(size=(x0.shape[0], 200))
+    >>> S = re.stimulus_reconstruction(x0, y0, s0, ts)
+    >>> S.shape
+    (200, 32, 32)
+    """
 
-    else:
-        raise NotImplementedError('Method not implemented')
+    if isinstance(x0, PRFSet):
+        betas = y0 if betas is None else betas
+        x0, y0, s0 = x0.x0, x0.y0, x0.s0
+    if betas is None:
+        raise TypeError('stimulus_reconstruction requires betas')
+
+    model = ReconstructionModel(x0, y0, s0, extent, resolution, method,
+                                clf=clf, alpha=alpha, chunk_size=chunk_size,
+                                max_memory=max_memory, engine=engine,
+                                grid=grid, truncate=truncate, solver=solver,
+                                tol=tol, dtype=dtype)
+    # ReconstructionModel expects trials first
+    S = model.fit().reconstruct(np.asarray(betas).T, lazy=lazy)
 
     return S
@@ -0,0 +1,554 @@
+import numpy as np
+
+__all__ = ["normal_equations", "RidgeGCV", "IterativeRidge"]
+
+
+def _chunk_size(n_voxel, n_pixel, chunk_size=None, max_memory=None,
+                itemsize=8):
+    """number of voxel rows per design matrix block"""
+    if chunk_size is None:
+        if max_memory is None:
+            return max(n_voxel, 1)
+        chunk_size = int(max_memory // (n_pixel * itemsize))
+        if chunk_size < 1:
+            raise ValueError('max_memory=%s bytes cannot hold a single '
+                             'design matrix row (%s bytes)'
+                             % (max_memory, n_pixel * itemsize))
+    return int(max(1, min(chunk_size, n_voxel)))
+
+
+def normal_equations(X, y, chunk_size=None, max_memory=None,
+                     fit_intercept=True):
+    """accumulate the normal equations of a receptive field design matrix
+
+    The (n_voxel, n_pixel) design matrix is materialized in blocks of
+    voxel rows that are consumed right away, so peak memory is bounded by
+    one block plus the (n_pixel, n_pixel) Gram matrix, independent of the
+    number of voxels.
+
+    Parameters
+    ----------
+    X : SeparableRFMatrix | array | sparse matrix, shape(n_voxel, n_pixel)
+        Receptive field design matrix. Sparse matrices are not chunked.
+    y : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+        Voxel activations.
+    chunk_size : int | None
+        Number of voxel rows per block (default=None).
+    max_memory : int | None
+        Memory budget of a design matrix block in bytes (default=None). Only
+        used if ``chunk_size`` is None. If both are None a single block is
+        used.
+    fit_intercept : bool
+        Center design matrix and activations across voxels (default=True).
+
+    Returns
+    -------
+    XtX : array, shape(n_pixel, n_pixel)
+        (Centered) Gram matrix ``X.T @ X``, float32 for float32 ``X``.
+    Xty : array, shape(n_pixel, ) **or** shape(n_pixel, n_targets)
+        (Centered) right-hand side ``X.T @ y``.
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> X = SeparableRFMatrix(x0, y0, s0)
+    >>> XtX, Xty = normal_equations(X, betas, max_memory=2**20)
+    """
+    dtype = _float_dtype(X)
+    y = np.asarray(y, dtype=dtype)
+    n_voxel, n_pixel = X.shape
+
+    if _issparse(X):
+        # sparse products never materialize the design matrix
+        XtX = (X.T.dot(X)).toarray()
+        Xty = X.T.dot(y)
+        X_sum = np.asarray(X.sum(0)).ravel()
+    else:
+        chunk_size = _chunk_size(n_voxel, n_pixel, chunk_size, max_memory,
+                                 np.dtype(dtype).itemsize)
+        XtX = np.zeros((n_pixel, n_pixel), dtype=dtype)
+        Xty = np.zeros((n_pixel, ) + y.shape[1:], dtype=dtype)
+        X_sum = np.zeros(n_pixel, dtype=dtype)
+        for rows, X_block in _iter_blocks(X, chunk_size):
+            XtX += np.dot(X_block.T, X_block)
+            Xty += np.dot(X_block.T, y[rows])
+            X_sum += X_block.sum(0)
+
+    if fit_intercept:
+        X_mean = X_sum / n_voxel
+        XtX -= n_voxel * np.outer(X_mean, X_mean)
+        Xty -= np.multiply.outer(X_sum, y.mean(0))
+
+    return XtX, Xty
+
+
+def _float_dtype(X):
+    """float32 design matrices are solved in single precision"""
+    return np.float32 if X.dtype == np.float32 else np.float64
+
+
+def _issparse(X):
+    # duck-typed, avoids importing scipy.sparse for dense input
+    return hasattr(X, 'tocsr') and not isinstance(X, np.ndarray)
+
+
+def _gram(X):
+    """X @ X.T for dense/sparse arrays and receptive field operators"""
+    if isinstance(X, np.ndarray):
+        return np.dot(X, X.T)
+    if _issparse(X):
+        return X.dot(X.T).toarray()
+    return X.gram()
+
+
+def _matvec(X, w):
+    if isinstance(X, np.ndarray) or _issparse(X):
+        return X.dot(w)
+    return X.matvec(w)
+
+
+def _rmatvec(X, b):
+    if isinstance(X, np.ndarray) or _issparse(X):
+        return X.T.dot(b)
+    return X.rmatvec(b)
+
+
+def _iter_blocks(X, chunk_size):
+    """blocks of rows, dense for operators and sparse for sparse matrices"""
+    if isinstance(X, np.ndarray) or _issparse(X):
+        return ((slice(i, i + chunk_size), X[i:i + chunk_size])
+                for i in range(0, X.shape[0], chunk_size))
+    return X.iter_dense(chunk_size)
+
+
+def _dual_coef(X, Y, coef, intercept, alpha):
+    """voxel weights of a ridge solution, the scaled residuals"""
+    residuals = Y - _matvec(X, coef.T) - intercept
+    return residuals / alpha
+
+
+class RidgeGCV(object):
+    """Ridge regression with efficient generalized cross-validation
+
+    The centered design matrix is eigendecomposed once, after which the
+    ridge solution and the leave-one-out (LOO) errors of all ``alphas``
+    follow in closed form. Sweeping a grid of regularization strengths
+    therefore costs about as much as a single fit. Samples are voxels and
+    features are pixels, i.e. ``coef_`` holds the reconstructed image(s).
+
+    Depending on the shape of the design matrix either the
+    (n_voxel, n_voxel) kernel ``X @ X.T`` (``mode='dual'``) or the
+    (n_pixel, n_pixel) Gram matrix ``X.T @ X`` (``mode='primal'``) is
+    decomposed. The latter is accumulated in voxel blocks, whose size is
+    bounded by ``chunk_size`` or ``max_memory``. A ``max_memory`` budget
+    also has to hold the workspace of the dual decomposition (about four
+    (n_voxel, n_voxel) matrices), ``'auto'`` falls back to the primal mode
+    if it does not. The budget does not cover the (n_pixel, n_pixel)
+    matrices of the primal mode nor the solutions of ``solve``.
+
+    Parameters
+    ----------
+    alphas : sequence of floats
+        Positive regularization strengths to evaluate
+        (default=(0.1, 1., 10., 20., 30., 50., 100.)).
+    fit_intercept : bool
+        Fit an unpenalized intercept (default=True).
+    alpha_per_target : bool
+        Select the best alpha separately for every target (default=False).
+    mode : string ['auto'|'dual'|'primal']
+        Matrix to decompose (default='auto'). ``'auto'`` picks the smaller
+        one, or ``'primal'`` if a ``chunk_size`` is given.
+
+    Notes
+    -----
+    A float32 design matrix is decomposed and solved in single precision.
+
+    Attributes
+    ----------
+    coef_ : array, shape(n_pixel, ) **or** shape(n_targets, n_pixel)
+        Ridge coefficients.
+    intercept_ : float | array, shape(n_targets, )
+        Intercept.
+    dual_coef_ : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+        Voxel weights of the solution, ``coef_ = X.T @ dual_coef_``.
+    alpha_ : float | array, shape(n_targets, )
+        Selected regularization strength.
+    cv_errors_ : array, shape(n_alphas, ) **or** shape(n_alphas, n_targets)
+        Mean squared LOO error of every alpha.
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> X = SeparableRFMatrix(x0, y0, s0)
+    >>> clf = RidgeGCV(alphas=np.logspace(-2, 3, 50)).fit(X, betas)
+    >>> S = clf.coef_.reshape(X.image_shape)
+    """
+
+    def __init__(self, alphas=(0.1, 1., 10., 20., 30., 50., 100.),
+                 fit_intercept=True, alpha_per_target=False, mode='auto'):
+        self.alphas = alphas
+        self.fit_intercept = fit_intercept
+        self.alpha_per_target = alpha_per_target
+        self.mode = mode
+
+    def fit(self, X, y, chunk_size=None, max_memory=None):
+        """decompose ``X`` and solve for ``y``
+
+        Parameters
+        ----------
+        X : SeparableRFMatrix | array | sparse matrix, shape(n_voxel, n_pixel)
+            Receptive field design matrix.
+        y : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+            Voxel activations.
+        chunk_size : int | None
+            Voxel rows per design matrix block, implies ``'primal'`` mode.
+        max_memory : int | None
+            Memory budget in bytes of a design matrix block in ``'primal'``
+            mode and of the decomposition workspace in ``'dual'`` mode.
+        """
+        return self.decompose(X, chunk_size, max_memory).solve(y)
+
+    def decompose(self, X, chunk_size=None, max_memory=None):
+        """eigendecompose the design matrix, independent of ``y``"""
+        from scipy import linalg
+
+        dtype = _float_dtype(X)
+        alphas = np.atleast_1d(np.asarray(self.alphas, dtype=dtype))
+        if alphas.ndim != 1 or np.any(alphas <= 0):
+            raise ValueError('alphas must be a 1D sequence of positive '
+                             'values, got %s' % (self.alphas, ))
+
+        n_voxel, n_pixel = X.shape
+        mode = self._resolve_mode(X, chunk_size, max_memory)
+
+        if self.fit_intercept:
+            X_mean = _rmatvec(X, np.ones(n_voxel, dtype=dtype)) / n_voxel
+        else:
+            X_mean = np.zeros(n_pixel, dtype=dtype)
+
+        if mode == 'dual':
+            K = _gram(X)
+            if self.fit_intercept:
+                # center the kernel, the intercept becomes the (unpenalized)
+                # constant eigenvector
+                K_mean = K.mean(0)
+                K -= K_mean[np.newaxis, :]
+                K -= K_mean[:, np.newaxis]
+                K += K_mean.mean() + 1.
+            eigvals, Q = linalg.eigh(K, overwrite_a=True)
+            penalized = np.ones(n_voxel, dtype=bool)
+            if self.fit_intercept:
+                penalized[np.argmax(np.abs(Q.sum(0)))] = False
+            # inverse of the eigenvalues of (K + alpha * I) for all alphas
+            W = np.where(penalized[:, np.newaxis],
+                         1. / (eigvals[:, np.newaxis] + alphas), 0.)
+            self._G_inverse_diag = np.dot(Q**2, W)
+            self._Q = Q
+        else:
+            chunk_size = _chunk_size(n_voxel, n_pixel, chunk_size,
+                                     max_memory, np.dtype(dtype).itemsize)
+            XtX, _ = normal_equations(X, np.zeros(n_voxel), chunk_size,
+                                      fit_intercept=self.fit_intercept)
+            eigvals, V = linalg.eigh(XtX, overwrite_a=True)
+            W = 1. / (np.maximum(eigvals, 0)[:, np.newaxis] + alphas)
+
+            # leverage (diagonal of the hat matrix) of every voxel
+            hat_diag = np.empty((n_voxel, alphas.shape[0]), dtype=dtype)
+            X_mean_V = np.dot(X_mean, V)
+            for rows, X_block in _iter_blocks(X, chunk_size):
+                P = X_block.dot(V) - X_mean_V
+                hat_diag[rows] = np.dot(P**2, W)
+            if self.fit_intercept:
+                hat_diag += 1. / n_voxel
+            self._hat_diag = hat_diag
+            self._V = V
+
+        self.mode_ = mode
+        self._alphas = alphas
+        self._eigvals = eigvals
+        self._W = W
+        self._X = X
+        self._X_mean = X_mean
+        return self
+
+    _decomposition_attrs = {
+        'dual': ('_eigvals', '_W', '_X_mean', '_Q', '_G_inverse_diag'),
+        'primal': ('_eigvals', '_W', '_X_mean', '_V', '_hat_diag')}
+
+    def _resolve_mode(self, X, chunk_size=None, max_memory=None):
+        """decomposed matrix, the dual workspace has to fit the budget"""
+        n_voxel, n_pixel = X.shape
+        # the kernel, the factors of an operator's gram and the eigenvectors
+        kernel_bytes = 4 * n_voxel**2 * np.dtype(_float_dtype(X)).itemsize
+        fits = max_memory is None or kernel_bytes <= max_memory
+        mode = self.mode
+        if mode == 'auto':
+            dual = n_voxel <= n_pixel and chunk_size is None and fits
+            mode = 'dual' if dual else 'primal'
+        if mode not in ('dual', 'primal'):
+            raise ValueError("mode must be 'auto', 'dual' or 'primal'")
+        if mode == 'dual' and chunk_size is not None:
+            raise ValueError("chunk_size requires mode='primal' or 'auto'")
+        if mode == 'dual' and not fits:
+            raise ValueError('max_memory=%s bytes cannot hold the dual '
+                             'decomposition (%s bytes)'
+                             % (max_memory, kernel_bytes))
+        return mode
+
+    def decomposition_names(self, X, chunk_size=None, max_memory=None):
+        """names of the arrays ``get_decomposition`` returns for ``X``"""
+        mode = self._resolve_mode(X, chunk_size, max_memory)
+        return tuple(name.lstrip('_')
+                     for name in self._decomposition_attrs[mode])
+
+    def get_decomposition(self):
+        """arrays of the decomposition, e.g. to store them in a cache"""
+        return dict((name.lstrip('_'), getattr(self, name))
+                    for name in self._decomposition_attrs[self.mode_])
+
+    def set_decomposition(self, X, arrays):
+        """restore a decomposition of ``X`` from ``get_decomposition``"""
+        mode = 'dual' if 'Q' in arrays else 'primal'
+        for name in self._decomposition_attrs[mode]:
+            setattr(self, name, arrays[name.lstrip('_')])
+        self.mode_ = mode
+        self._alphas = np.atleast_1d(np.asarray(
+            self.alphas, dtype=self._eigvals.dtype))
+        self._X = X
+        return self
+
+    def solve(self, y):
+        """ridge solution for new activations ``y``, reusing the decomposition
+
+        Parameters
+        ----------
+        y : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+            Voxel activations.
+        """
+        dtype = self._eigvals.dtype
+        y = np.asarray(y, dtype=dtype)
+        if y.shape[0] != self._X.shape[0]:
+            raise ValueError('y has %s rows, design matrix has %s voxels'
+                             % (y.shape[0], self._X.shape[0]))
+        Y = y.reshape(y.shape[0], -1)
+        n_targets = Y.shape[1]
+
+        if self.mode_ == 'dual':
+            QtY = np.dot(self._Q.T, Y)
+        else:
+            y_mean = Y.mean(0) if self.fit_intercept else np.zeros(n_targets)
+            XtY = _rmatvec(self._X, Y - y_mean) - np.multiply.outer(
+                self._X_mean, (Y - y_mean).sum(0))
+            Z = np.dot(self._V.T, XtY)
+
+        def _coef(i, targets):
+            """dual (or primal) coefficients of the i-th alpha"""
+            if self.mode_ == 'dual':
+                QtY_i = self._W[:, i, np.newaxis] * QtY[:, targets]
+                return np.dot(self._Q, QtY_i)
+            return np.dot(self._V, self._W[:, i, np.newaxis] * Z[:, targets])
+
+        targets = np.arange(n_targets)
+        cv_errors = np.empty((self._alphas.shape[0], n_targets), dtype=dtype)
+        for i in range(self._alphas.shape[0]):
+            C = _coef(i, targets)
+            if self.mode_ == 'dual':
+                errors = C / self._G_inverse_diag[:, i, np.newaxis]
+            else:
+                Y_hat = _matvec(self._X, C) - np.dot(self._X_mean, C)
+                Y_hat += y_mean
+                hat_diag = self._hat_diag[:, i, np.newaxis]
+                errors = (Y - Y_hat) / (1. - hat_diag)
+            cv_errors[i] = (errors**2).mean(0)
+
+        if self.alpha_per_target:
+            best = np.argmin(cv_errors, axis=0)
+        else:
+            best = np.repeat(np.argmin(cv_errors.mean(1)), n_targets)
+
+        C = np.empty((self._X.shape[self.mode_ == 'primal'], n_targets),
+                     dtype=dtype)
+        for i in np.unique(best):
+            C[:, best == i] = _coef(i, targets[best == i])
+        if self.mode_ == 'dual':
+            coef = _rmatvec(self._X, C)
+            coef -= np.multiply.outer(self._X_mean, C.sum(0))
+            coef = coef.T
+        else:
+            coef = C.T
+
+        if self.fit_intercept:
+            intercept = Y.mean(0) - np.dot(coef, self._X_mean)
+        else:
+            intercept = np.zeros(n_targets, dtype=dtype)
+        alpha = self._alphas[best]
+
+        if self.mode_ == 'dual' and self.fit_intercept:
+            dual_coef = C - C.mean(0)
+        elif self.mode_ == 'dual':
+            dual_coef = C
+        else:
+            dual_coef = _dual_coef(self._X, Y, coef, intercept, alpha)
+
+        if y.ndim == 1:
+            coef, intercept, alpha = coef[0], intercept[0], alpha[0]
+            dual_coef = dual_coef[:, 0]
+            cv_errors = cv_errors[:, 0]
+        elif not self.alpha_per_target:
+            alpha = alpha[0]
+
+        self.coef_ = coef
+        self.dual_coef_ = dual_coef
+        self.intercept_ = intercept
+        self.alpha_ = alpha
+        self.cv_errors_ = cv_errors
+        return self
+
+
+class IterativeRidge(object):
+    """Ridge regression with matrix-free iterative solvers
+
+    The design matrix is only accessed through products with vectors, so
+    the (n_voxel, n_pixel) matrix never needs to be materialized. Each
+    target is solved starting from the previous solution (warm start), which
+    speeds up series of similar activation patterns.
+
+    Parameters
+    ----------
+    alpha : float
+        Regularization strength (default=10.).
+    solver : string ['cg'|'lsqr']
+        ``'cg'`` runs conjugate gradients on the normal equations in the
+        smaller of voxel and pixel space, ``'lsqr'`` solves the damped least
+        squares problem (default='cg').
+    tol : float
+        Relative tolerance of the solver (default=1e-6).
+    max_iter : int | None
+        Maximum number of iterations per target (default=None).
+    fit_intercept : bool
+        Fit an unpenalized intercept (default=True).
+    warm_start : bool
+        Start from the last solution, also across calls to ``fit``
+        (default=True).
+
+    Attributes
+    ----------
+    coef_ : array, shape(n_pixel, ) **or** shape(n_targets, n_pixel)
+        Ridge coefficients.
+    dual_coef_ : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+        Voxel weights of the solution, ``coef_ = X.T @ dual_coef_``.
+    intercept_ : float | array, shape(n_targets, )
+        Intercept.
+    n_iter_ : list of ints
+        Number of iterations per target (``'lsqr'`` only, else None).
+
+    Examples
+    --------
+    >>> x0, y0, s0, r2, betas = example_prf_data()
+    >>> X = SeparableRFMatrix(x0, y0, s0, resolution=0.05)
+    >>> clf = IterativeRidge(alpha=10., solver='lsqr').fit(X, betas)
+    >>> S = clf.coef_.reshape(X.image_shape)
+    """
+
+    def __init__(self, alpha=10., solver='cg', tol=1e-6, max_iter=None,
+                 fit_intercept=True, warm_start=True):
+        self.alpha = alpha
+        self.solver = solver
+        self.tol = tol
+        self.max_iter = max_iter
+        self.fit_intercept = fit_intercept
+        self.warm_start = warm_start
+
+    def fit(self, X, y):
+        """solve the ridge problem for every column of ``y``
+
+        Parameters
+        ----------
+        X : SeparableRFMatrix | array | sparse matrix, shape(n_voxel, n_pixel)
+            Receptive field design matrix.
+        y : array, shape(n_voxel, ) **or** shape(n_voxel, n_targets)
+            Voxel activations.
+        """
+        from scipy.sparse import linalg
+
+        if self.solver not in ('cg', 'lsqr'):
+            raise ValueError("solver must be 'cg' or 'lsqr'")
+
+        dtype = _float_dtype(X)
+        y = np.asarray(y, dtype=dtype)
+        Y = y.reshape(y.shape[0], -1)
+        n_voxel, n_pixel = X.shape
+
+        if self.fit_intercept:
+            X_mean = _rmatvec(X, np.ones(n_voxel, dtype=dtype)) / n_voxel
+            y_mean = Y.mean(0)
+        else:
+            X_mean = np.zeros(n_pixel, dtype=dtype)
+            y_mean = np.zeros(Y.shape[1], dtype=dtype)
+
+        # products with the centered design matrix
+        def matvec(w):
+            w = np.ravel(w)
+            return _matvec(X, w) - np.dot(X_mean, w)
+
+        def rmatvec(b):
+            b = np.ravel(b)
+            return _rmatvec(X, b) - X_mean * b.sum()
+
+        dual = self.solver == 'cg' and n_voxel < n_pixel
+        if self.solver == 'lsqr':
+            # lsqr damps the update from x0, so warm starts need the damping
+            # written out as an augmented system [Xc; sqrt(alpha) I]
+            damp = np.sqrt(self.alpha)
+            A = linalg.LinearOperator(
+                (n_voxel + n_pixel, n_pixel), dtype=dtype,
+                matvec=lambda w: np.r_[matvec(w), damp * np.ravel(w)],
+                rmatvec=lambda b: rmatvec(b[:n_voxel]) + damp * b[n_voxel:])
+        elif dual:
+            A = linalg.LinearOperator(
+                (n_voxel, n_voxel), dtype=dtype,
+                matvec=lambda c: matvec(rmatvec(c)) + self.alpha * np.ravel(c))
+        elif self.solver == 'cg':
+            A = linalg.LinearOperator(
+                (n_pixel, n_pixel), dtype=dtype,
+                matvec=lambda w: rmatvec(matvec(w)) + self.alpha * np.ravel(w))
+
+        x0 = getattr(self, '_x0', None) if self.warm_start else None
+        if x0 is not None and x0.shape[0] != (n_voxel if dual else n_pixel):
+            x0 = None
+
+        coef = np.empty((Y.shape[1], n_pixel), dtype=dtype)
+        n_iter = []
+        for t in range(Y.shape[1]):
+            b = Y[:, t] - y_mean[t]
+            if self.solver == 'lsqr':
+                b = np.r_[b, np.zeros(n_pixel, dtype=dtype)]
+                result = linalg.lsqr(A, b, atol=self.tol, btol=self.tol,
+                                     iter_lim=self.max_iter, x0=x0)
+                coef[t] = result[0]
+                x0 = result[0] if self.warm_start else None
+                n_iter.append(result[2])
+                continue
+
+            rhs = b if dual else rmatvec(b)
+            try:
+                x0, _ = linalg.cg(A, rhs, x0=x0, rtol=self.tol,
+                                  maxiter=self.max_iter)
+            except TypeError:  # scipy < 1.12
+                x0, _ = linalg.cg(A, rhs, x0=x0, tol=self.tol,
+                                  maxiter=self.max_iter)
+            coef[t] = rmatvec(x0) if dual else x0
+            if not self.warm_start:
+                x0 = None
+        self._x0 = x0
+
+        intercept = y_mean - np.dot(coef, X_mean)
+        dual_coef = _dual_coef(X, Y, coef, intercept, self.alpha)
+        if y.ndim == 1:
+            coef, intercept, dual_coef = coef[0], intercept[0], dual_coef[:, 0]
+
+        self.coef_ = coef
+        self.dual_coef_ = dual_coef
+        self.intercept_ = intercept
+        self.n_iter_ = n_iter if self.solver == 'lsqr' else None
+        return self
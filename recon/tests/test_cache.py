@@ -0,0 +1,58 @@
+from __future__ import absolute_import, division, print_function
+import os
+import numpy as np
+import numpy.testing as npt
+import recon as re
+
+
+def test_basis_cache(tmpdir):
+    cache = re.BasisCache(str(tmpdir), max_bytes=2**20)
+    key = cache.key('test', np.arange(3), [-8, 8, -8, 8], 0.5)
+    npt.assert_equal(key, cache.key('test', np.arange(3.), (-8, 8, -8, 8),
+                                    0.5))
+    assert key != cache.key('test', np.arange(3), [-8, 8, -8, 8], 0.25)
+
+    assert cache.get(key) is None
+    cache.put(key, {'a': np.ones(10)})
+    a = cache.get(key)['a']
+    assert isinstance(a, np.memmap)
+    npt.assert_equal(a, np.ones(10))
+
+    # least recently used entries are evicted
+    cache.put(cache.key(1), {'a': np.zeros(2**16)})
+    os.utime(os.path.join(str(tmpdir), cache.key(1)), (0, 0))
+    cache.put(cache.key(2), {'a': np.zeros(2**16)})
+    assert cache.get(cache.key(1)) is None
+    assert cache.get(cache.key(2)) is not None
+    assert cache.size() <= 2**20
+
+    cache.clear()
+    npt.assert_equal(cache.size(), 0)
+
+
+def test_reconstruction_model_cache(tmpdir):
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    for method in ['summation', 'multivariate']:
+        S = re.ReconstructionModel(x0, y0, s0,
+                                   method=method).fit().reconstruct(betas)
+        for _ in range(2):
+            model = re.ReconstructionModel(x0, y0, s0, method=method,
+                                           cache=str(tmpdir)).fit()
+            npt.assert_almost_equal(model.reconstruct(betas), S)
+    npt.assert_equal(len(os.listdir(str(tmpdir))), 2)
+
+
+def test_basis_cache_partial_entry(tmpdir):
+    cache = re.BasisCache(str(tmpdir))
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    S = re.ReconstructionModel(x0, y0, s0, method='multivariate',
+                               cache=cache).fit().reconstruct(betas)
+
+    # entries half-deleted by a concurrent eviction are cache misses
+    for key in os.listdir(str(tmpdir)):
+        path = os.path.join(str(tmpdir), key)
+        os.remove(os.path.join(path, sorted(os.listdir(path))[0]))
+    assert cache.get(key, ('a', )) is None
+    model = re.ReconstructionModel(x0, y0, s0, method='multivariate',
+                                   cache=cache).fit()
+    npt.assert_almost_equal(model.reconstruct(betas), S)
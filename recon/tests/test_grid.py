@@ -0,0 +1,89 @@
+from __future__ import absolute_import, division, print_function
+import pickle
+import numpy as np
+import numpy.testing as npt
+import recon as re
+
+
+def test_visual_field_grid():
+    grid = re.VisualFieldGrid([-8, 8, -4, 4], resolution=0.5)
+    npt.assert_equal(grid.shape, (16, 32))
+    npt.assert_equal(grid.size, 16 * 32)
+    npt.assert_equal(grid.xv, np.arange(-8, 8, 0.5))
+    npt.assert_equal(grid.yv, np.arange(-4, 4, 0.5)[::-1])
+    npt.assert_raises(ValueError, grid.xv.__setitem__, 0, 1.)
+    npt.assert_raises(AttributeError, setattr, grid, 'resolution', 1.)
+    npt.assert_equal(pickle.loads(pickle.dumps(grid)).xv, grid.xv)
+
+
+def test_get_grid():
+    grid = re.get_grid([-8, 8, -8, 8], 0.5)
+    assert re.get_grid((-8., 8., -8., 8.), 0.5) is grid
+    assert re.get_grid([-8, 8, -8, 8], 0.25) is not grid
+
+    G = re.gaussian_receptive_field(x0=1., y0=3., s0=1., grid=grid)
+    npt.assert_equal(G, re.gaussian_receptive_field(x0=1., y0=3., s0=1.))
+
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=10)
+    grid = re.VisualFieldGrid([-4, 4, -2, 2], 0.25)
+    npt.assert_equal(re.gaussian_receptive_fields(x0, y0, s0, grid=grid),
+                     re.gaussian_receptive_fields(x0, y0, s0,
+                                                  extent=[-4, 4, -2, 2],
+                                                  resolution=0.25))
+    for method in ['summation', 'multivariate']:
+        S = re.stimulus_reconstruction(x0, y0, s0, betas, method=method,
+                                       grid=grid)
+        npt.assert_equal(S.shape, grid.shape)
+    npt.assert_raises(TypeError, re.SeparableRFMatrix, x0, y0, s0,
+                      grid=[-8, 8, -8, 8])
+
+
+def test_point_grid():
+    grid = re.PointGrid([0., 1., 2.], [0., 0., 1.])
+    npt.assert_equal(grid.shape, (3, ))
+    npt.assert_raises(ValueError, grid.x.__setitem__, 0, 1.)
+    npt.assert_raises(ValueError, re.PointGrid, [0., 1.], [0.])
+    npt.assert_equal(pickle.loads(pickle.dumps(grid)).y, grid.y)
+
+    # a point grid of all pixels matches the regular grid
+    regular = re.get_grid([-8, 8, -4, 4], 0.5)
+    xv, yv = np.meshgrid(regular.xv, regular.yv)
+    grid = re.PointGrid(xv, yv)
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+
+    G = re.gaussian_receptive_field(1., 2., 1.5, grid=grid)
+    npt.assert_almost_equal(G, re.gaussian_receptive_field(
+        1., 2., 1.5, grid=regular).ravel())
+    G = re.gaussian_receptive_fields(x0, y0, s0, grid=grid, norm=True)
+    npt.assert_almost_equal(G, re.gaussian_receptive_fields(
+        x0, y0, s0, grid=regular, norm=True).reshape(20, -1))
+
+    ts = np.random.RandomState(0).normal(size=(20, 3))
+    for kw in [dict(method='summation'),
+               dict(method='multivariate'),
+               dict(method='multivariate', solver='cg', tol=1e-10),
+               dict(method='multivariate', truncate=3.)]:
+        S = re.stimulus_reconstruction(x0, y0, s0, ts, grid=grid, **kw)
+        npt.assert_equal(S.shape, (3, grid.size))
+        npt.assert_almost_equal(S, re.stimulus_reconstruction(
+            x0, y0, s0, ts, grid=regular, **kw).reshape(3, -1))
+
+        rec = re.stimulus_reconstruction(x0, y0, s0, ts, grid=grid,
+                                         lazy=True, **kw)
+        npt.assert_almost_equal(np.asarray(rec), S)
+        npt.assert_equal(rec.render(grid=regular).shape, (3, 16, 32))
+
+    npt.assert_raises(ValueError, re.stimulus_reconstruction, x0, y0, s0,
+                      betas, grid=grid, engine='numba')
+    npt.assert_raises(TypeError, re.SeparableRFMatrix, x0, y0, s0,
+                      grid=grid)
+
+
+def test_log_polar_grid():
+    grid = re.log_polar_grid(8., n_eccentricity=10, n_angle=12, e2=0.5)
+    npt.assert_equal(grid.size, 1 + 9 * 12)
+    ecc = np.hypot(grid.x, grid.y)
+    npt.assert_almost_equal([ecc.min(), ecc.max()], [0., 8.])
+    # ring spacing grows with eccentricity
+    rings = np.unique(np.round(ecc, 6))
+    assert np.all(np.diff(np.diff(rings)) > 0)
@@ -0,0 +1,19 @@
+from __future__ import absolute_import, division, print_function
+import subprocess
+import sys
+import numpy.testing as npt
+
+HEAVY_MODULES = ['numba', 'llvmlite', 'nibabel', 'scipy', 'sklearn']
+
+
+def test_import_is_lightweight():
+    # import in a fresh interpreter, other tests already loaded everything
+    code = ('import sys, time; t0 = time.time(); import recon; '
+            'print("%%s|%%s" %% (time.time() - t0, " ".join('
+            'm for m in %r if m in sys.modules)))' % (HEAVY_MODULES, ))
+    out = subprocess.check_output([sys.executable, '-c', code])
+    import_time, loaded = out.decode().splitlines()[-1].split('|')
+
+    npt.assert_equal(loaded.split(), [])
+    # generous bound, numba alone used to take several tenths of a second
+    assert float(import_time) < 5.
@@ -0,0 +1,44 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import numpy.testing as npt
+import recon as re
+from recon import kernels
+
+
+def test_kernels(monkeypatch):
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=15)
+    B = np.random.RandomState(0).normal(size=(15, 3))
+    X = re.SeparableRFMatrix(x0, y0, s0, extent=[-8, 8, -4, 4])
+    S = X.rmatvec(B).T.reshape(3, 16, 32)
+
+    for has_numba in [kernels.HAS_NUMBA, False]:
+        monkeypatch.setattr(kernels, 'HAS_NUMBA', has_numba)
+        npt.assert_almost_equal(
+            kernels.rf_summation(x0, y0, s0, B, X.xv, X.yv), S)
+        npt.assert_almost_equal(
+            kernels.rf_design_matrix(x0, y0, s0, X.xv, X.yv), X.todense())
+
+
+def test_rf_summation_fft():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=60)
+    B = np.random.RandomState(0).normal(size=(60, 3))
+    grid = re.get_grid(resolution=0.25)
+
+    # centers on pixels and few distinct sizes, exact up to truncation
+    x0, y0 = np.round(x0 * 4) / 4, np.round(y0 * 4) / 4
+    s0 = np.array([0.5, 1., 2.])[np.arange(60) % 3]
+    S = re.SeparableRFMatrix(x0, y0, s0, grid=grid).rmatvec(B).T
+    S_fft = kernels.rf_summation_fft(x0, y0, s0, B, grid).reshape(3, -1)
+    npt.assert_allclose(S_fft, S, atol=1e-3 * np.abs(S).max())
+
+    # arbitrary centers and sizes
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=60)
+    s0 = s0 + 0.5
+    S = re.SeparableRFMatrix(x0, y0, s0, grid=grid).rmatvec(B).T
+    S_fft = kernels.rf_summation_fft(x0, y0, s0, B, grid).reshape(3, -1)
+    npt.assert_allclose(S_fft, S, atol=2e-2 * np.abs(S).max())
+
+    # sizes of 0 (failed pRF fits) can not be binned logarithmically
+    s0[0] = 0.
+    npt.assert_raises(ValueError, kernels.rf_summation_fft, x0, y0, s0, B,
+                      grid)
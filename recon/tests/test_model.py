@@ -0,0 +1,123 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import numpy.testing as npt
+import recon as re
+
+
+def test_reconstruction_model():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=30)
+    trials = np.random.RandomState(0).normal(size=(4, 30))
+
+    for method in ['summation', 'multivariate']:
+        model = re.ReconstructionModel(x0, y0, s0, resolution=1.,
+                                       method=method).fit()
+        S = model.reconstruct(trials)
+        npt.assert_equal(S.shape, (4, 16, 16))
+        for i in range(4):
+            npt.assert_almost_equal(S[i], re.stimulus_reconstruction(
+                x0, y0, s0, trials[i], method=method, resolution=1.))
+
+        npt.assert_equal(model.reconstruct(betas).shape, (16, 16))
+        npt.assert_raises(ValueError, model.reconstruct, betas[:10])
+
+
+def test_reconstruction_model_shapes():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=10)
+    npt.assert_raises(ValueError, re.ReconstructionModel, x0, y0, s0[:5])
+    npt.assert_raises(ValueError, re.stimulus_reconstruction, x0[:5], y0,
+                      s0, betas)
+
+
+def test_reconstruction_model_numba():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=30)
+    trials = np.random.RandomState(0).normal(size=(4, 30))
+
+    model = re.ReconstructionModel(x0, y0, s0, engine='numba').fit()
+    npt.assert_almost_equal(model.reconstruct(trials), re.ReconstructionModel(
+        x0, y0, s0).fit().reconstruct(trials))
+    npt.assert_raises(NotImplementedError,
+                      re.ReconstructionModel(x0, y0, s0, engine='gpu').fit)
+
+
+def test_reconstruction_model_truncate():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=30)
+    trials = np.random.RandomState(0).normal(size=(4, 30))
+
+    for method in ['summation', 'multivariate']:
+        S = re.ReconstructionModel(x0, y0, s0,
+                                   method=method).fit().reconstruct(trials)
+        model = re.ReconstructionModel(x0, y0, s0, method=method,
+                                       truncate=100.).fit()
+        npt.assert_almost_equal(model.reconstruct(trials), S)
+
+        model = re.ReconstructionModel(x0, y0, s0, method=method,
+                                       truncate=3.).fit()
+        npt.assert_almost_equal(model.reconstruct(trials), S, decimal=1)
+
+
+def test_reconstruction_model_analytic():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=30)
+    s0 = s0 + 0.5
+    trials = np.random.RandomState(0).normal(size=(4, 30))
+
+    S = re.ReconstructionModel(x0, y0, s0, method='multivariate',
+                               resolution=0.25, alpha=10.).fit().reconstruct(
+                                   trials)
+    S_analytic = re.ReconstructionModel(
+        x0, y0, s0, method='multivariate', resolution=0.25, alpha=10.,
+        solver='analytic').fit().reconstruct(trials)
+    npt.assert_allclose(S_analytic, S, atol=1e-3 * np.abs(S).max())
+
+    npt.assert_raises(ValueError, re.ReconstructionModel(
+        x0, y0, s0, method='multivariate', solver='analytic',
+        truncate=3.).fit)
+
+
+def test_reconstruction_model_fft():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=30)
+    s0 = s0 + 0.5
+    trials = np.random.RandomState(0).normal(size=(4, 30))
+
+    S = re.ReconstructionModel(x0, y0, s0).fit().reconstruct(trials)
+    S_fft = re.ReconstructionModel(x0, y0, s0, engine='fft',
+                                   n_bins=30).fit().reconstruct(trials)
+    npt.assert_allclose(S_fft, S, atol=5e-2 * np.abs(S).max())
+    npt.assert_raises(ValueError, re.ReconstructionModel(
+        x0, y0, s0, engine='fft', truncate=3.).fit)
+    npt.assert_raises(ValueError, re.ReconstructionModel(
+        x0, y0, np.where(s0 > 1., s0, 0.), engine='fft').fit)
+
+
+def test_reconstruction_lazy():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=30)
+    trials = np.random.RandomState(0).normal(size=(4, 30))
+
+    kwargs = [dict(method='summation'),
+              dict(method='multivariate'),
+              dict(method='multivariate', clf=re.RidgeGCV(mode='primal')),
+              dict(method='multivariate', solver='cg', tol=1e-10),
+              dict(method='multivariate', truncate=3.)]
+    for kw in kwargs:
+        model = re.ReconstructionModel(x0, y0, s0, **kw).fit()
+        S = model.reconstruct(trials)
+        rec = model.reconstruct(trials, lazy=True)
+        npt.assert_equal(rec.shape, S.shape)
+        npt.assert_almost_equal(np.asarray(rec), S)
+
+        # sub-extent on the same pixels and probe points
+        grid = model.grid_
+        npt.assert_almost_equal(rec.render(extent=[-4, 4, -2, 2]),
+                                S[:, 12:20, 8:24])
+        xv, yv = np.meshgrid(grid.xv[[3, 10]], grid.yv[[5, 7]])
+        npt.assert_almost_equal(rec.evaluate(xv, yv, chunk_size=3),
+                                S[:, [5, 7]][:, :, [3, 10]])
+
+        rec = model.reconstruct(trials[0], lazy=True)
+        npt.assert_almost_equal(np.asarray(rec), S[0])
+        npt.assert_equal(rec.render(resolution=0.25).shape, (64, 64))
+
+    # only s0**2 matters, also for truncated receptive fields
+    model = re.ReconstructionModel(x0, y0, -s0, truncate=3.).fit()
+    rec = model.reconstruct(trials, lazy=True)
+    npt.assert_almost_equal(rec.evaluate(xv, yv),
+                            np.asarray(rec)[:, [5, 7]][:, :, [3, 10]])
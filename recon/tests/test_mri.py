@@ -17,3 +17,137 @@ def test_save_mri():
     os.remove('temp_data.nii')
 
     npt.assert_equal(np.ones((5*5*5, 1)), data)
+
+
+def test_load_mri(tmpdir):
+    rng = np.random.RandomState(0)
+    mask = rng.uniform(size=(4, 5, 6)) > .5
+    data = rng.randint(0, 100, size=(4, 5, 6, 7)).astype(np.int16)
+    mask_file = str(tmpdir.join('mask.nii'))
+    func_file = str(tmpdir.join('func.nii'))
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), func_file)
+
+    ts = re.load_mri(func_file, mask_file)
+    npt.assert_equal(ts, data[mask])
+    npt.assert_equal(ts.dtype, np.int16)
+
+    nib.save(nib.Nifti1Image(data[..., 0], np.eye(4)), func_file)
+    npt.assert_equal(re.load_mri(func_file, mask_file), data[..., 0][mask])
+
+
+def test_iter_mri(tmpdir):
+    rng = np.random.RandomState(0)
+    mask = rng.uniform(size=(4, 5, 6)) > .5
+    data = rng.normal(size=(4, 5, 6, 7))
+    mask_file = str(tmpdir.join('mask.nii.gz'))
+    func_file = str(tmpdir.join('func.nii.gz'))
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), func_file)
+
+    chunks = list(re.iter_mri(func_file, mask_file, chunk_tps=3))
+    npt.assert_equal([ts.shape[1] for ts in chunks], [3, 3, 1])
+    npt.assert_equal(np.hstack(chunks), data[mask])
+    npt.assert_equal(re.load_mri(func_file, mask_file, chunk_tps=2),
+                     data[mask])
+
+
+def test_load_mri_many(tmpdir):
+    rng = np.random.RandomState(0)
+    mask = rng.uniform(size=(4, 5, 6)) > .5
+    mask_file = str(tmpdir.join('mask.nii'))
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+
+    runs, funcs = [], []
+    for i, n_tps in enumerate([3, 5, 2]):
+        runs.append(rng.normal(size=(4, 5, 6, n_tps)).astype(np.float32))
+        funcs.append(str(tmpdir.join('run%s.nii.gz' % i)))
+        nib.save(nib.Nifti1Image(runs[-1], np.eye(4)), funcs[-1])
+    expected = np.concatenate([run[mask] for run in runs], axis=1)
+
+    for n_jobs in [1, 2]:
+        ts = re.load_mri_many(funcs, mask_file, n_jobs=n_jobs, chunk_tps=2)
+        npt.assert_equal(ts, expected)
+        npt.assert_equal(ts.dtype, np.float32)
+    npt.assert_equal(re.load_mri_many(funcs, mask_file, n_jobs=2,
+                                      mp_context='forkserver'), expected)
+
+    out = np.memmap(str(tmpdir.join('out.dat')), dtype=np.float32,
+                    mode='w+', shape=expected.shape)
+    ts = re.load_mri_many(funcs, mask_file, n_jobs=2, out=out)
+    assert ts is out
+    npt.assert_equal(np.asarray(out), expected)
+
+
+def test_mask(tmpdir):
+    rng = np.random.RandomState(0)
+    m = rng.uniform(size=(4, 5, 6)) > .5
+    data = rng.normal(size=(4, 5, 6, 3))
+    affine = np.diag([2., 2., 2., 1.])
+    mask_file = str(tmpdir.join('mask.nii'))
+    nib.save(nib.Nifti1Image(m.astype(np.uint8), affine), mask_file)
+
+    mask = re.Mask(mask_file)
+    npt.assert_equal(mask.n_voxel, m.sum())
+    npt.assert_equal(mask.affine, affine)
+    npt.assert_equal(mask.to_array(), m)
+    npt.assert_equal(mask.take(data), data[m])
+    npt.assert_equal(mask.take(np.asfortranarray(data)), data[m])
+    npt.assert_equal(mask.take(data[..., 0]), data[..., 0][m])
+    npt.assert_equal(re.Mask(m).indices, mask.indices)
+    npt.assert_raises(ValueError, mask.take, data[1:])
+
+    func_file = str(tmpdir.join('func.nii'))
+    re.save_mri(data[m], mask, fname=func_file)
+    npt.assert_equal(nib.load(func_file).affine, affine)
+    npt.assert_equal(re.load_mri(func_file, mask), data[m])
+
+
+def test_save_mri_dtype(tmpdir):
+    rng = np.random.RandomState(0)
+    m = rng.uniform(size=(4, 5, 6)) > .5
+    data = rng.normal(size=(m.sum(), 3)).astype(np.float32)
+    mask_file = str(tmpdir.join('mask.nii'))
+    nib.save(nib.Nifti1Image(m.astype(np.uint8), np.eye(4)), mask_file)
+
+    for fname in ['data.nii', 'data.nii.gz']:
+        fname = str(tmpdir.join(fname))
+        re.save_mri(data, mask_file, fname)
+        img = nib.load(fname)
+        npt.assert_equal(img.get_data_dtype(), np.float32)
+        npt.assert_equal(img.shape, (4, 5, 6, 3))
+        npt.assert_equal(np.asanyarray(img.dataobj)[m], data)
+        npt.assert_equal(np.asanyarray(img.dataobj)[~m], 0)
+
+    re.save_mri(data[:, 0], mask_file, fname, dtype=np.float64)
+    npt.assert_equal(nib.load(fname).get_data_dtype(), np.float64)
+    npt.assert_equal(re.load_mri(fname, mask_file)[:, 0], data[:, 0])
+
+    img = re.save_mri(data, mask_file)
+    npt.assert_equal(img.get_fdata()[m], data)
+
+
+def test_save_mri_formats(tmpdir):
+    import pathlib
+    rng = np.random.RandomState(0)
+    m = rng.uniform(size=(4, 5, 6)) > .5
+    labels = np.arange(m.sum())
+    mask_file = str(tmpdir.join('mask.nii'))
+    nib.save(nib.Nifti1Image(m.astype(np.uint8), np.eye(4)), mask_file)
+
+    # 64-bit integers are not accepted by nibabel as they are
+    img = re.save_mri(labels, mask_file)
+    npt.assert_equal(img.get_data_dtype(), np.int32)
+    npt.assert_equal(np.asanyarray(img.dataobj)[m][:, 0], labels)
+    img = re.save_mri(labels * 2**40, mask_file)
+    npt.assert_equal(img.get_data_dtype(), np.float64)
+
+    for fname in ['labels.nii.gz', 'labels.img']:
+        fname = pathlib.Path(str(tmpdir.join(fname)))
+        re.save_mri(labels, mask_file, fname)
+        npt.assert_equal(re.load_mri(str(fname), mask_file)[:, 0], labels)
+
+    fname = str(tmpdir.join('labels.nii'))
+    re.save_mri(labels, mask_file, fname, dtype=np.int64)
+    npt.assert_equal(nib.load(fname).get_data_dtype(), np.int64)
+    npt.assert_equal(re.load_mri(fname, mask_file)[:, 0], labels)
@@ -0,0 +1,108 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import numpy.testing as npt
+import recon as re
+
+
+def test_separable_rf_matrix():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=10)
+    X = re.SeparableRFMatrix(x0, y0, s0, extent=[-8, 8, -4, 4])
+    npt.assert_equal(X.shape, (10, 16 * 32))
+    npt.assert_equal(X.image_shape, (16, 32))
+
+    D = X.todense()
+    G = re.gaussian_receptive_fields(x0, y0, s0, extent=[-8, 8, -4, 4])
+    npt.assert_almost_equal(D, G.reshape(10, -1))
+
+    rng = np.random.RandomState(0)
+    w = rng.normal(size=D.shape[1])
+    W = rng.normal(size=(D.shape[1], 3))
+    B = rng.normal(size=(10, 3))
+
+    npt.assert_almost_equal(X.matvec(w), D.dot(w))
+    npt.assert_almost_equal(X.matvec(W), D.dot(W))
+    npt.assert_almost_equal(X.rmatvec(betas), D.T.dot(betas))
+    npt.assert_almost_equal(X.rmatvec(B), D.T.dot(B))
+    npt.assert_almost_equal(X.gram(), D.dot(D.T))
+
+    # blocks of voxels, separable for few and dense for many targets
+    X.block_size = 300
+    for n_targets in [3, 20]:
+        W = rng.normal(size=(D.shape[1], n_targets))
+        B = rng.normal(size=(10, n_targets))
+        npt.assert_almost_equal(X.matvec(W), D.dot(W))
+        npt.assert_almost_equal(X.rmatvec(B), D.T.dot(B))
+
+
+def test_separable_rf_matrix_tosparse():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=10)
+    # voxel 0 lies completely outside of the screen
+    x0[0] = 20.
+    s0[0] = 1.
+    X = re.SeparableRFMatrix(x0, y0, s0, extent=[-8, 8, -4, 4])
+    D = X.todense()
+
+    X_sparse = X.tosparse(truncate=2.)
+    npt.assert_equal(X_sparse.shape, D.shape)
+    npt.assert_equal(X_sparse[0].nnz, 0)
+
+    D_sparse = X_sparse.toarray()
+    inside = D >= np.exp(-2.**2 / 2.)
+    npt.assert_almost_equal(D_sparse[inside], D[inside])
+    # everything outside of the bounding box is dropped
+    npt.assert_equal(D_sparse[D < np.exp(-2.**2)], 0)
+    npt.assert_almost_equal(X.tosparse(truncate=100.).toarray(), D)
+
+
+def test_analytic_rf_matrix():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    s0 = s0 + 0.5
+    X = re.SeparableRFMatrix(x0, y0, s0, resolution=0.25)
+    A = re.AnalyticRFMatrix(x0, y0, s0, resolution=0.25)
+    npt.assert_almost_equal(A.todense(), X.todense())
+    K = X.gram()
+    npt.assert_allclose(A.gram(), K, atol=1e-4 * K.max())
+
+    # receptive fields cut off at the screen border
+    X = re.SeparableRFMatrix(x0 + 6, y0, s0, resolution=0.25)
+    A = re.AnalyticRFMatrix(x0 + 6, y0, s0, resolution=0.25)
+    A_inf = re.AnalyticRFMatrix(x0 + 6, y0, s0, resolution=0.25,
+                                finite_screen=False)
+    K = X.gram()
+    npt.assert_allclose(A.gram(), K, atol=1e-3 * K.max())
+    assert np.abs(A_inf.gram() - K).max() > 0.1 * K.max()
+
+
+def test_point_rf_matrix():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=10)
+    grid = re.log_polar_grid(8., n_eccentricity=8, n_angle=16)
+    X = re.PointRFMatrix(x0, y0, s0, grid, block_size=50)
+    npt.assert_equal(X.shape, (10, grid.size))
+
+    D = X.todense()
+    npt.assert_almost_equal(D, re.gaussian_receptive_fields(x0, y0, s0,
+                                                            grid=grid))
+    rng = np.random.RandomState(0)
+    W = rng.normal(size=(grid.size, 3))
+    B = rng.normal(size=(10, 3))
+    npt.assert_almost_equal(X.matvec(W), D.dot(W))
+    npt.assert_almost_equal(X.rmatvec(betas), D.T.dot(betas))
+    npt.assert_almost_equal(X.rmatvec(B), D.T.dot(B))
+    npt.assert_almost_equal(X.gram(), D.dot(D.T))
+
+    # blocks of voxels, separable for few and dense for many targets
+    X.block_size = 300
+    for n_targets in [3, 20]:
+        W = rng.normal(size=(D.shape[1], n_targets))
+        B = rng.normal(size=(10, n_targets))
+        npt.assert_almost_equal(X.matvec(W), D.dot(W))
+        npt.assert_almost_equal(X.rmatvec(B), D.T.dot(B))
+
+    # same truncation as the separable operator on a point grid of pixels
+    regular = re.get_grid(resolution=0.5)
+    xv, yv = np.meshgrid(regular.xv, regular.yv)
+    expected = re.SeparableRFMatrix(x0, y0, s0, grid=regular).tosparse(2.)
+    for sign in [1, -1]:  # only s0**2 matters
+        sp = re.PointRFMatrix(x0, y0, sign * s0, re.PointGrid(xv, yv),
+                              block_size=300).tosparse(2.)
+        npt.assert_almost_equal(sp.toarray(), expected.toarray())
@@ -0,0 +1,77 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import numpy.testing as npt
+import recon as re
+
+
+def test_prf_set():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    prfs = re.PRFSet(x0, y0, s0, r2)
+    npt.assert_equal(len(prfs), 20)
+    npt.assert_equal(prfs.data.shape, (4, 20))
+    assert prfs.data.flags.c_contiguous
+    npt.assert_equal(prfs.astuple(), (x0, y0, s0, r2))
+    npt.assert_raises(AttributeError, setattr, prfs, 'extra', 1)
+
+    # slices are views, masks and indices copies
+    sub = prfs[5:10]
+    assert np.shares_memory(sub.data, prfs.data)
+    npt.assert_equal(sub.s0, s0[5:10])
+    npt.assert_equal(prfs[s0 < 1].x0, x0[s0 < 1])
+    npt.assert_equal(prfs[[1, 3]].y0, y0[[1, 3]])
+    for i in [0, np.int64(7), -1]:
+        npt.assert_equal(prfs[i].astuple(), ([x0[i]], [y0[i]], [s0[i]],
+                                             [r2[i]]))
+
+    npt.assert_equal(re.PRFSet(x0, y0, s0, dtype=np.float32).data.dtype,
+                     np.float32)
+    assert np.all(np.isnan(re.PRFSet(x0, y0, s0).r2))
+    npt.assert_raises(ValueError, re.PRFSet.from_array, np.zeros((3, 10)))
+
+
+def test_prf_set_select():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=50)
+    r2 = np.linspace(0, 10, 50)
+    prfs = re.PRFSet(x0, y0, s0, r2)
+
+    expected = re.select_prf(x0, y0, s0, r2, r2_thr=3., s0_thr=1.5,
+                             verbose=False)
+    idx = prfs.select(r2_thr=3., s0_thr=1.5)
+    npt.assert_equal(idx, expected[-1])
+    selected, idx = re.select_prf(prfs, r2_thr=3., s0_thr=1.5,
+                                  verbose=False)
+    npt.assert_equal(selected.astuple(), expected[:4])
+
+    # unknown r2 passes
+    npt.assert_equal(re.PRFSet(x0, y0, s0).select(s0_thr=1.5),
+                     re.select_prf(x0, y0, s0, s0_thr=1.5, verbose=False)[-1])
+
+
+def test_prf_set_io(tmpdir):
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    prfs = re.PRFSet(x0, y0, s0, r2)
+    for ext in ['.npy', '.npz']:
+        fname = str(tmpdir.join('prfs' + ext))
+        prfs.save(fname)
+        loaded = re.PRFSet.load(fname)
+        npt.assert_equal(loaded.data, prfs.data)
+    assert isinstance(re.PRFSet.load(str(tmpdir.join('prfs.npy'))).data,
+                      np.memmap)
+
+
+def test_prf_set_accepted():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    prfs = re.PRFSet(x0, y0, s0, r2)
+
+    npt.assert_equal(re.gaussian_receptive_fields(prfs),
+                     re.gaussian_receptive_fields(x0, y0, s0))
+    npt.assert_equal(re.SeparableRFMatrix(prfs).gram(),
+                     re.SeparableRFMatrix(x0, y0, s0).gram())
+    for method in ['summation', 'multivariate']:
+        npt.assert_almost_equal(
+            re.stimulus_reconstruction(prfs, betas, method=method),
+            re.stimulus_reconstruction(x0, y0, s0, betas, method=method))
+    model = re.ReconstructionModel(prfs, resolution=1.).fit()
+    npt.assert_equal(model.reconstruct(betas).shape, (16, 16))
+    npt.assert_raises(TypeError, re.stimulus_reconstruction, prfs)
+    npt.assert_raises(TypeError, re.SeparableRFMatrix, x0)
@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import numpy.testing as npt
+import nibabel as nib
+import recon as re
+
+
+def test_profile(tmpdir):
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    mask_file = str(tmpdir.join('mask.nii'))
+    func_file = str(tmpdir.join('func.nii'))
+    nib.save(nib.Nifti1Image(np.ones((4, 5, 1), dtype=np.uint8), np.eye(4)),
+             mask_file)
+
+    with re.Profile(trace_memory=True) as prof:
+        re.stimulus_reconstruction(x0, y0, s0, betas, method='multivariate')
+        re.save_mri(betas, mask_file, func_file)
+        re.load_mri(func_file, mask_file)
+
+    stages = [record['stage'] for record in prof.records]
+    npt.assert_equal(stages, ['reconstruction.grid',
+                              'reconstruction.rf_basis',
+                              'reconstruction.ridge_decompose',
+                              'reconstruction.multivariate',
+                              'save_mri.mask', 'save_mri.write',
+                              'load_mri.mask', 'load_mri.read'])
+    record = prof.records[3]
+    npt.assert_equal(record['shapes'], {'S': (1, 32 * 32)})
+    npt.assert_equal(record['nbytes'], 32 * 32 * 8)
+    assert record['peak_memory'] > 0
+
+    summary = prof.summary()
+    npt.assert_equal(summary['load_mri.read']['calls'], 1)
+    assert 'reconstruction.rf_basis' in prof.report()
+
+    # the profiler is uninstalled afterwards
+    re.load_mri(func_file, mask_file)
+    npt.assert_equal(len(prof.records), 8)
+
+
+def test_set_profiler():
+    records = []
+    assert re.set_profiler(records.append) is None
+    re.stimulus_reconstruction(*re.example_prf_data(n_voxel=5)[:3],
+                               betas=np.ones(5))
+    assert re.set_profiler(None) == records.append
+    npt.assert_equal(len(records), 3)
+    assert records[0]['memory'] is None
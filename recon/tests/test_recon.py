@@ -14,12 +14,31 @@ def test_gaussian_receptive_field():
     npt.assert_equal(G.shape, (32, 32))
 
 
+def test_gaussian_receptive_fields():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=5)
+    G = re.gaussian_receptive_fields(x0, y0, s0, amplitude=betas)
+    npt.assert_equal(G.shape, (5, 32, 32))
+
+    for i in range(5):
+        npt.assert_almost_equal(G[i], re.gaussian_receptive_field(
+            x0[i], y0[i], s0[i], betas[i]))
+
+    G = re.gaussian_receptive_fields(x0, y0, s0, norm=True,
+                                     extent=[-4, 4, -2, 2])
+    npt.assert_equal(G.shape, (5, 8, 16))
+    npt.assert_almost_equal(G.sum(axis=(1, 2)), np.ones(5))
+
+
 def test_gaussian_receptive_field_faster():
     G = re.gaussian_receptive_field_faster(x0=1., y0=3., s0=1., amplitude=1.)
 
     # A basic test that the input and output have the same shape:
     npt.assert_equal(G.shape, (32, 32))
 
+    G = re.gaussian_receptive_field_faster(x0=1., y0=3., s0=2., amplitude=.5)
+    npt.assert_almost_equal(G, re.gaussian_receptive_field(
+        x0=1., y0=3., s0=2., amplitude=.5))
+
 
 def test_example_prf_data():
     x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=10)
@@ -51,3 +70,66 @@ def test_stimulus_reconstruction():
                                    extent=[-8, 8, -8, 8])
 
     npt.assert_equal(S.shape, (32, 32))
+
+
+def test_stimulus_reconstruction_summation():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+
+    S_loop = np.zeros((32, 32))
+    for i in range(20):
+        S_loop += re.gaussian_receptive_field(x0[i], y0[i], s0[i], betas[i])
+    S_loop /= 20
+
+    S = re.stimulus_reconstruction(x0, y0, s0, betas, method='summation')
+    npt.assert_almost_equal(S, S_loop)
+
+    # non-square screens
+    S = re.stimulus_reconstruction(x0, y0, s0, betas, method='summation',
+                                   extent=[-8, 8, -4, 4])
+    npt.assert_equal(S.shape, (16, 32))
+
+
+def test_stimulus_reconstruction_timeseries():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    ts = np.random.RandomState(0).normal(size=(20, 5))
+
+    for method in ['summation', 'multivariate']:
+        S = re.stimulus_reconstruction(x0, y0, s0, ts, method=method,
+                                       extent=[-8, 8, -4, 4])
+        npt.assert_equal(S.shape, (5, 16, 32))
+        npt.assert_almost_equal(S[2], re.stimulus_reconstruction(
+            x0, y0, s0, ts[:, 2], method=method, extent=[-8, 8, -4, 4]))
+
+    # whole runs, more timepoints than pixels along x and y
+    ts = np.random.RandomState(0).normal(size=(20, 40))
+    G = re.gaussian_receptive_fields(x0, y0, s0, extent=[-8, 8, -4, 4])
+    S = re.stimulus_reconstruction(x0, y0, s0, ts, extent=[-8, 8, -4, 4])
+    npt.assert_almost_equal(S, np.einsum('vij,vt->tij', G, ts) / 20)
+    S = re.stimulus_reconstruction(x0, y0, s0, ts, method='multivariate',
+                                   extent=[-8, 8, -4, 4])
+    npt.assert_almost_equal(S[25], re.stimulus_reconstruction(
+        x0, y0, s0, ts[:, 25], method='multivariate', extent=[-8, 8, -4, 4]))
+
+
+def test_float32():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=50)
+    ts = np.random.RandomState(0).normal(size=(50, 3))
+
+    G = re.gaussian_receptive_fields(x0, y0, s0, dtype=np.float32)
+    npt.assert_equal(G.dtype, np.float32)
+    npt.assert_allclose(G, re.gaussian_receptive_fields(x0, y0, s0),
+                        atol=1e-6)
+    G = re.gaussian_receptive_field(x0[0], y0[0], s0[0], dtype=np.float32)
+    npt.assert_equal(G.dtype, np.float32)
+
+    kwargs = [dict(method='summation'),
+              dict(method='summation', engine='numba'),
+              dict(method='multivariate', alpha=10.),
+              dict(method='multivariate', alpha=10., resolution=4.),
+              dict(method='multivariate', alpha=10., truncate=3.)]
+    for kw in kwargs:
+        S = re.stimulus_reconstruction(x0, y0, s0, ts, **kw)
+        S32 = re.stimulus_reconstruction(x0, y0, s0, ts, dtype=np.float32,
+                                         **kw)
+        npt.assert_equal(S32.dtype, np.float32)
+        npt.assert_allclose(S32, S, atol=1e-5 * np.abs(S).max())
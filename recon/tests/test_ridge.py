@@ -0,0 +1,141 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import numpy.testing as npt
+import recon as re
+
+
+def test_normal_equations():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=25)
+    X = re.SeparableRFMatrix(x0, y0, s0, resolution=1.)
+    D = X.todense()
+    Dc = D - D.mean(0)
+
+    for kwargs in [{}, {'chunk_size': 7}, {'max_memory': 3 * D[0].nbytes}]:
+        XtX, Xty = re.normal_equations(X, betas, **kwargs)
+        npt.assert_almost_equal(XtX, Dc.T.dot(Dc))
+        npt.assert_almost_equal(Xty, Dc.T.dot(betas - betas.mean()))
+
+    XtX, Xty = re.normal_equations(D, betas, chunk_size=4,
+                                   fit_intercept=False)
+    npt.assert_almost_equal(XtX, D.T.dot(D))
+    npt.assert_almost_equal(Xty, D.T.dot(betas))
+
+    npt.assert_raises(ValueError, re.normal_equations, X, betas,
+                      max_memory=8)
+
+
+def test_stimulus_reconstruction_chunked():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=30)
+    S = re.stimulus_reconstruction(x0, y0, s0, betas, method='multivariate',
+                                   resolution=1., max_memory=2**12)
+    S_full = re.stimulus_reconstruction(x0, y0, s0, betas,
+                                        method='multivariate',
+                                        resolution=1., chunk_size=30)
+    npt.assert_equal(S.shape, (16, 16))
+    npt.assert_almost_equal(S, S_full)
+
+    # the dual kernel has to fit the budget as well
+    X = re.SeparableRFMatrix(x0, y0, s0, resolution=1.)
+    clf = re.RidgeGCV().decompose(X, max_memory=4 * 30 * 30 * 8)
+    npt.assert_equal(clf.mode_, 'dual')
+    clf = re.RidgeGCV().decompose(X, max_memory=4 * 30 * 30 * 8 - 1)
+    npt.assert_equal(clf.mode_, 'primal')
+    npt.assert_equal(re.RidgeGCV().decompose(X, chunk_size=10).mode_,
+                     'primal')
+    npt.assert_raises(ValueError, re.RidgeGCV(mode='dual').decompose, X,
+                      max_memory=4 * 30 * 30 * 8 - 1)
+    npt.assert_raises(ValueError, re.RidgeGCV(mode='dual').decompose, X,
+                      chunk_size=10)
+    npt.assert_raises(ValueError, re.stimulus_reconstruction, x0, y0, s0,
+                      betas, method='multivariate', max_memory=8)
+
+
+def _loo_errors(D, y, alpha):
+    """brute-force leave-one-out errors of ridge with intercept"""
+    errors = np.zeros(y.shape[0])
+    for i in range(y.shape[0]):
+        keep = np.arange(y.shape[0]) != i
+        X_mean, y_mean = D[keep].mean(0), y[keep].mean()
+        Xc = D[keep] - X_mean
+        w = np.linalg.solve(Xc.T.dot(Xc) + alpha * np.eye(D.shape[1]),
+                            Xc.T.dot(y[keep] - y_mean))
+        errors[i] = y[i] - (y_mean + (D[i] - X_mean).dot(w))
+    return (errors**2).mean()
+
+
+def test_ridge_gcv():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    alphas = [0.1, 1., 10.]
+
+    for resolution in [2., 8.]:
+        X = re.SeparableRFMatrix(x0, y0, s0, resolution=resolution)
+        D = X.todense()
+        Dc = D - D.mean(0)
+        loo = [_loo_errors(D, betas, alpha) for alpha in alphas]
+
+        for mode, kwargs in [('dual', {}), ('primal', {'chunk_size': 6})]:
+            clf = re.RidgeGCV(alphas, mode=mode).fit(X, betas, **kwargs)
+            npt.assert_almost_equal(clf.cv_errors_, loo)
+            npt.assert_equal(clf.alpha_, alphas[np.argmin(loo)])
+
+            coef = np.linalg.solve(
+                Dc.T.dot(Dc) + clf.alpha_ * np.eye(D.shape[1]),
+                Dc.T.dot(betas - betas.mean()))
+            npt.assert_almost_equal(clf.coef_, coef)
+            npt.assert_almost_equal(clf.intercept_,
+                                    betas.mean() - D.mean(0).dot(coef))
+
+    # multiple targets reuse the decomposition
+    Y = np.random.RandomState(0).normal(size=(20, 3))
+    clf = re.RidgeGCV(alphas, alpha_per_target=True).decompose(X)
+    clf.solve(Y)
+    npt.assert_equal(clf.coef_.shape, (3, D.shape[1]))
+    npt.assert_equal(clf.alpha_.shape, (3, ))
+    for i in range(3):
+        npt.assert_almost_equal(clf.solve(Y[:, i]).coef_,
+                                re.RidgeGCV(alphas).fit(D, Y[:, i]).coef_)
+
+    npt.assert_raises(ValueError, re.RidgeGCV([0, 1.]).fit, X, betas)
+
+
+def test_iterative_ridge():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    Y = np.random.RandomState(0).normal(size=(20, 3))
+
+    for resolution in [1., 8.]:
+        X = re.SeparableRFMatrix(x0, y0, s0, resolution=resolution)
+        expected = re.RidgeGCV([5.]).fit(X, Y)
+        for solver in ['cg', 'lsqr']:
+            clf = re.IterativeRidge(5., solver=solver, tol=1e-10).fit(X, Y)
+            npt.assert_almost_equal(clf.coef_, expected.coef_)
+            npt.assert_almost_equal(clf.intercept_, expected.intercept_)
+
+            # warm start from the previous solution
+            clf.fit(X.todense(), Y[:, 2])
+            npt.assert_almost_equal(clf.coef_, expected.coef_[2])
+
+    npt.assert_raises(ValueError, re.IterativeRidge(solver='qr').fit, X, Y)
+
+
+def test_stimulus_reconstruction_iterative():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    S = re.stimulus_reconstruction(x0, y0, s0, betas, method='multivariate',
+                                   alpha=5.)
+    for solver in ['cg', 'lsqr']:
+        npt.assert_almost_equal(re.stimulus_reconstruction(
+            x0, y0, s0, betas, method='multivariate', alpha=5.,
+            solver=solver, tol=1e-10), S)
+
+
+def test_dual_coef():
+    x0, y0, s0, r2, betas = re.example_prf_data(n_voxel=20)
+    Y = np.random.RandomState(0).normal(size=(20, 3))
+    X = re.SeparableRFMatrix(x0, y0, s0, resolution=2.)
+
+    for clf in [re.RidgeGCV(mode='dual'), re.RidgeGCV(mode='primal'),
+                re.RidgeGCV(fit_intercept=False),
+                re.IterativeRidge(5., tol=1e-10)]:
+        clf.fit(X, Y)
+        npt.assert_almost_equal(X.rmatvec(clf.dual_coef_).T, clf.coef_)
+        clf.fit(X, betas)
+        npt.assert_almost_equal(X.rmatvec(clf.dual_coef_), clf.coef_)